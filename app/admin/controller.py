@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from app.sensors.controller import get_db, get_timescale, get_redis_client, get_mongodb_client, get_elastic_search, get_cassandra_client, get_readings_publisher
+from shared.cassandra_client import CassandraClient
+from shared.elasticsearch_client import ElasticsearchClient
+from shared.mongodb_client import MongoDBClient
+from shared.publisher import Publisher
+from shared.redis_client import RedisClient
+from shared.timescale import Timescale
+from shared.sensors import repository, models
+from shared import write_coordinator
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+)
+
+
+#Aquest endpoint ens retornarà els chunks de la hypertable sensor_data, les estadístiques de compressió i les polítiques actives.
+@router.get("/timescale")
+def get_timescale_stats(timescale: Timescale = Depends(get_timescale)):
+    return repository.get_timescale_stats(timescale)
+
+#Aquest endpoint torna a calcular els comptadors de sensors per tipus a partir de PostgreSQL.
+@router.post("/quantities/reconcile")
+def reconcile_sensor_quantities(db: Session = Depends(get_db), redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.reconcile_sensor_quantities(db, redis_client)
+
+#Aquest endpoint torna a generar les cel·les del mapa de /sensors/clusters a partir de PostgreSQL.
+@router.post("/clusters/rebuild")
+def rebuild_sensor_tiles(db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+    return repository.rebuild_sensor_tiles(db, mongodb_client)
+
+#Aquest endpoint ens retornarà les escriptures secundàries que han fallat i estan pendents de reintentar.
+@router.get("/failed_writes")
+def get_failed_writes(limit: int = 100, db: Session = Depends(get_db)):
+    return db.query(models.FailedWrite).order_by(models.FailedWrite.id).limit(limit).all()
+
+#Aquest endpoint torna a executar les escriptures pendents i esborra les que ja han anat bé.
+@router.post("/failed_writes/retry")
+def retry_failed_writes(limit: int = 100, db: Session = Depends(get_db), timescale: Timescale = Depends(get_timescale), redis_client: RedisClient = Depends(get_redis_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client), elasticsearch_client: ElasticsearchClient = Depends(get_elastic_search), cassandra_client: CassandraClient = Depends(get_cassandra_client), publisher: Publisher = Depends(get_readings_publisher)):
+    clients = {'timescale': timescale, 'redis': redis_client, 'mongodb': mongodb_client, 'elasticsearch': elasticsearch_client, 'cassandra': cassandra_client, 'rabbitmq': publisher}
+    return write_coordinator.retry_failed_writes(db, clients, limit=limit)
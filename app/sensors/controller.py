@@ -1,16 +1,21 @@
 import json
+import threading
 
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
 from shared.database import SessionLocal
-from shared.publisher import Publisher
+from shared.cache import DATA_CACHE_TTL, cached
+from shared import backends
+from shared.publisher import Publisher, QUEUE_NAME, READINGS_QUEUE_NAME
 from shared.redis_client import RedisClient
 from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient
 from shared.sensors.repository import DataCommand
 from shared.timescale import Timescale
 from shared.sensors import repository, schemas, models
+from shared.sensors.codec import READING_BODY, Reading, reading_body
 from shared.cassandra_client import CassandraClient
 
 
@@ -23,52 +28,56 @@ def get_db():
 
 
 def get_timescale():
-    ts = Timescale()
+    ts = backends.timescale()
     try:
         yield ts
     finally:
         ts.close()
 
-# Dependency to get redis client
+# Els clients de Redis, MongoDB, Elasticsearch i Cassandra són thread-safe i tenen el seu pool de connexions, així que
+# se'n crea un per procés al primer ús (després del fork a cada worker). Crear-los a cada petició obria connexions, i
+# a Cassandra executava el DDL d'init_tables, fins i tot quan la resposta sortia de la cache
+clients = {}
+clients_lock = threading.Lock()
+
+def shared_client(name, factory):
+    client = clients.get(name)
+    if client is None:
+        with clients_lock:
+            client = clients.get(name)
+            if client is None:
+                client = clients[name] = factory()
+    return client
 
+# Dependency to get redis client
 def get_redis_client():
-    redis = RedisClient(host="redis")
-    try:
-        yield redis
-    finally:
-        redis.close()
+    return shared_client("redis", lambda: backends.redis_client(host="redis"))
 
 # Dependency to get mongodb client
-
 def get_mongodb_client():
-    mongodb = MongoDBClient(host="mongodb")
-    try:
-        yield mongodb
-    finally:
-        mongodb.close()
+    return shared_client("mongodb", backends.mongodb_client)
 
 # Dependency to get elastic_search client
 def get_elastic_search():
-    es = ElasticsearchClient(host="elasticsearch")
-    try:
-        yield es
-    finally:
-        es.close()
+    return shared_client("elasticsearch", backends.elasticsearch_client)
 
 # Dependency to get cassandra client
 def get_cassandra_client():
-    cassandra = CassandraClient(hosts=["cassandra"])
-    try:
-        yield cassandra
-    finally:
-        cassandra.close()
+    return shared_client("cassandra", backends.cassandra_client)
 
-publisher = Publisher()
+# La connexió amb RabbitMQ es fa a la primera publicació, així cada worker té la seva i no se'n comparteix cap de abans
+# del fork. Si RabbitMQ no hi és la publicació falla dins del fan_out i queda a failed_writes, la petició no se n'ressent
+def get_publisher():
+    return shared_client("publisher", lambda: backends.publisher(QUEUE_NAME, connect=False))
+
+def get_readings_publisher():
+    return shared_client("readings_publisher", lambda: backends.publisher(READINGS_QUEUE_NAME, connect=False))
 
 router = APIRouter(
     prefix="/sensors",
     responses={404: {"description": "Not found"}},
     tags=["sensors"],
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -77,6 +86,12 @@ router = APIRouter(
 def get_sensors_near(latitude: float, longitude: float, radius: float, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
     return repository.get_sensors_near(redis=redis_client, mongodb_client=mongodb_client, db=db, latitude=latitude, longitude=longitude, radius=radius)
 
+#Aquest endpoint ens retornarà els sensors de la caixa agrupats per cel·les de geohash segons el zoom del mapa.
+@router.get("/clusters")
+@cached(tags=("sensors",), ttl=DATA_CACHE_TTL)
+def get_sensor_clusters(min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float, zoom: int = Query(ge=0, le=22), summary: bool = True, mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.get_sensor_clusters(mongodb_client, redis_client, min_latitude, min_longitude, max_latitude, max_longitude, zoom, summary=summary)
+
 # 🙋🏽‍♀️ Add here the route to search sensors by query to Elasticsearch
 # Parameters:
 # - query: string to search
@@ -93,36 +108,52 @@ def search_sensors(query: str, size: int = 10, search_type: str = "match", db: S
 
 #Aquest endpoint ens retornarà el valor màxim, mínim i mitjà de la temperatura dels sensors de temperatura.
 @router.get("/temperature/values")
+@cached(tags=("sensors", "sensor_data"), ttl=DATA_CACHE_TTL)
 def get_temperature_values(db: Session = Depends(get_db),mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
     return repository.get_temperature_values(db, mongodb_client, cassandra_client)
 
 #Aquest endpoint ens retornarà el nombre de sensors per a cada tipus de sensor.
 @router.get("/quantity_by_type")
-def get_sensors_quantity(db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_sensors_quantity(cassandra_client)
+@cached(tags=("sensors",))
+def get_sensors_quantity(db: Session = Depends(get_db), redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.get_sensors_quantity(redis_client, db)
 
 #Aquest endpoint ens retornarà aquells sensors que tenen un valor de bateria inferior al 20%.
 @router.get("/low_battery")
+@cached(tags=("sensors", "sensor_data"), ttl=DATA_CACHE_TTL)
 def get_low_battery_sensors(db: Session = Depends(get_db),mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
     return repository.get_low_battery_sensors(db, mongodb_client, cassandra_client)
 
-# 🙋🏽‍♀️ Add here the route to get all sensors
-@router.get("")
-def get_sensors(db: Session = Depends(get_db)):
-    return repository.get_sensors(db)
+#Aquest endpoint ens retornarà les dades agrupades per intervals de temps de diversos sensors amb una sola query.
+#Els sensors es poden indicar per id o filtrant per tipus i/o posició.
+@router.post("/data/query")
+def query_data(query: schemas.SensorDataQuery, db: Session = Depends(get_db), timescale: Timescale = Depends(get_timescale)):
+    sensor_ids = query.sensor_ids
+    if sensor_ids is None:
+        sensor_ids = repository.get_sensor_ids(db, sensor_type=query.type, latitude=query.latitude, longitude=query.longitude, radius=query.radius)
+    return repository.query_data_timescale(sensor_ids=sensor_ids, timescale=timescale, from_date=query.from_date, end_date=query.end_date, bucket=query.bucket)
 
+# 🙋🏽‍♀️ Add here the route to get all sensors
+#Paginat per cursor: la resposta porta next_cursor, que s'ha de passar com a cursor per obtenir la pàgina següent.
+#Amb fields=name,type només es retornen aquestes columnes (i el id).
 @router.get("")
-def get_sensors(db: Session = Depends(get_db)):
-    return repository.get_sensors(db)
+def get_sensors(limit: int = Query(100, ge=1, le=1000), cursor: str = None, fields: str = None, type: str = None, manufacturer: str = None, db: Session = Depends(get_db)):
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    return repository.get_sensors(db, limit=limit, cursor=cursor, fields=field_list, sensor_type=type, manufacturer=manufacturer)
 
 
 # 🙋🏽‍♀️ Add here the route to create a sensor
 @router.post("")
-def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), elasticsearch_client: ElasticsearchClient = Depends(get_elastic_search), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
+def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), elasticsearch_client: ElasticsearchClient = Depends(get_elastic_search), redis_client: RedisClient = Depends(get_redis_client)):
     db_sensor = repository.get_sensor_by_name(db, sensor.name)
     if db_sensor:
         raise HTTPException(status_code=400, detail="Sensor with same name already registered")
-    return repository.create_sensor(db, sensor, mongodb_client, elasticsearch_client, cassandra_client)
+    return repository.create_sensor(db, sensor, mongodb_client, elasticsearch_client, redis_client)
+
+#Registre de molts sensors alhora, retorna el resultat de cada sensor en el mateix ordre que la petició
+@router.post("/bulk")
+def create_sensors_bulk(sensors: list[schemas.SensorCreate], db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), elasticsearch_client: ElasticsearchClient = Depends(get_elastic_search), redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.create_sensors_bulk(db, sensors, mongodb_client, elasticsearch_client, redis_client)
 
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
 @router.get("/{sensor_id}")
@@ -134,20 +165,21 @@ def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: Mo
 
 # 🙋🏽‍♀️ Add here the route to delete a sensor
 @router.delete("/{sensor_id}")
-def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis: RedisClient = Depends(get_redis_client)):
+def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis: RedisClient = Depends(get_redis_client), elasticsearch_client: ElasticsearchClient = Depends(get_elastic_search), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
     db_sensor = repository.get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return repository.delete_sensor(db=db, sensor_id=sensor_id, mongodb_client=mongodb_client, redis=redis)  
+    return repository.delete_sensor(db=db, sensor_id=sensor_id, mongodb_client=mongodb_client, redis=redis, elasticsearch_client=elasticsearch_client, cassandra_client=cassandra_client)  
 
 
 # 🙋🏽‍♀️ Add here the route to update a sensor
-@router.post("/{sensor_id}/data")
-def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), timescale: Timescale=Depends(get_timescale), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
+# El cos es llegeix amb el codec lleuger (orjson + Reading) i la resposta ja surt serialitzada, sense passar per jsonable_encoder
+@router.post("/{sensor_id}/data", openapi_extra=READING_BODY)
+def record_data(sensor_id: int, data: Reading = Depends(reading_body), db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), timescale: Timescale=Depends(get_timescale), cassandra_client: CassandraClient = Depends(get_cassandra_client), publisher: Publisher = Depends(get_readings_publisher)):
     db_sensor = repository.get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data, timescale=timescale, cassandra_client=cassandra_client)
+    return ORJSONResponse(repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data, timescale=timescale, cassandra_client=cassandra_client, db=db, publisher=publisher))
 
 
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
@@ -159,7 +191,7 @@ def get_data(sensor_id: int, from_date: str = Query(None, alias='from'), end_dat
     if all((from_date is not None, end_date is not None, bucket is not None)):
         return repository.get_data_timescale(sensor_id=sensor_id, timescale=timescale, from_date=from_date, end_date=end_date, bucket=bucket)
     else:
-        return repository.get_data(redis=redis_client, sensor_id=sensor_id, db=db)
+        return ORJSONResponse(repository.get_data(redis=redis_client, sensor_id=sensor_id, db=db))
 
 class ExamplePayload():
     def __init__(self, example):
@@ -168,7 +200,7 @@ class ExamplePayload():
     def to_json(self):
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 @router.post("/exemple/queue")
-def exemple_queue():
+def exemple_queue(publisher: Publisher = Depends(get_publisher)):
     # Publish here the data to the queue
     publisher.publish(ExamplePayload("holaaaaa"))
     return {"message": "Data published to the queue"}
\ No newline at end of file
@@ -22,6 +22,7 @@ def clear_dbs():
     redis.close()
     mongo = MongoDBClient(host="mongodb")
     mongo.clearDb("sensors")
+    mongo.clearTiles()
     mongo.close()
     es = ElasticsearchClient(host="elasticsearch")
     es.clearIndex("sensors")  
@@ -225,4 +226,147 @@ def test_get_sensors_low_battery():
     response = client.get("/sensors/low_battery")
     assert response.status_code == 200
     assert response.json() == {"sensors": [{"id": 2, "name": "Velocitat 1", "latitude": 1.0, "longitude": 1.0, "type": "Velocitat", "mac_address": "00:00:00:00:00:01", "manufacturer": "Dummy", "model":"Dummy Vel", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de velocitat model Dummy Vel del fabricant Dummy cruïlla 1", "battery_level": 0.1}, {"id": 3, "name": "Velocitat 2", "latitude": 2.0, "longitude": 2.0, "type": "Velocitat", "mac_address": "00:00:00:00:00:02", "manufacturer": "Dummy", "model":"Dummy Vel", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de velocitat model Dummy Vel del fabricant Dummy cruïlla 2", "battery_level": 0.15}]}
-    
\ No newline at end of file
+    
+def test_query_data_multiple_sensors():
+    response = client.post("/sensors/data/query", json={"sensor_ids": [1, 4], "from": "2020-01-01T00:00:00.000Z", "to": "2020-01-03T00:00:00.000Z", "bucket": "day"})
+    assert response.status_code == 200
+    assert response.json() == {"bucket": "day", "sensors": [
+        {"id": 1, "time": ["2020-01-01T00:00:00"], "velocity": [None], "temperature": [4.0], "humidity": [1.0], "battery_level": [1.0]},
+        {"id": 4, "time": ["2020-01-02T00:00:00"], "velocity": [None], "temperature": [17.0], "humidity": [1.0], "battery_level": [1.0]}]}
+
+def test_query_data_invalid_bucket():
+    response = client.post("/sensors/data/query", json={"type": "Temperatura", "from": "2020-01-01T00:00:00.000Z", "to": "2020-01-03T00:00:00.000Z", "bucket": "minute; DROP TABLE sensor_data"})
+    assert response.status_code == 400
+
+def test_get_timescale_stats():
+    response = client.get("/admin/timescale")
+    assert response.status_code == 200
+    assert {"chunks", "compression", "policies"} <= response.json().keys()
+
+def test_get_sensor_data_invalid_bucket():
+    response = client.get("/sensors/1/data?from=2020-01-01T00:00:00.000Z&to=2020-01-03T00:00:00.000Z&bucket=day' OR '1'='1")
+    assert response.status_code == 400
+    assert "Invalid bucket size" in response.text
+
+def test_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_request_seconds_count{method="POST",route="/sensors/{sensor_id}/data",status="200"}' in response.text
+    assert 'backend_operation_seconds_count{backend="timescale",operation="insert_sensor_data"}' in response.text
+
+def test_failed_writes_retry():
+    response = client.post("/admin/failed_writes/retry")
+    assert response.status_code == 200
+    assert response.json() == {"retried": 0, "pending": 0}
+
+def test_delete_sensor_removes_projections():
+    response = client.post("/sensors", json={"name": "Sensor Esborrar", "latitude": 3.0, "longitude": 3.0, "type": "Esborrar", "mac_address": "00:00:00:00:00:09", "manufacturer": "Dummy", "model":"Dummy Temp", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor que s'esborra"})
+    assert response.status_code == 200
+    sensor_id = response.json()["id"]
+    response = client.delete(f"/sensors/{sensor_id}")
+    assert response.status_code == 200
+    mongodb_client = MongoDBClient(host="mongodb")
+    assert mongodb_client.getDocument({"id": sensor_id}) is None
+    mongodb_client.close()
+    response = client.get("/sensors/quantity_by_type")
+    assert {"type": "Esborrar", "quantity": 1} not in response.json()["sensors"]
+
+def test_get_sensors_paginated():
+    response = client.get("/sensors?limit=2&fields=name,type")
+    assert response.status_code == 200
+    assert response.json()["sensors"] == [{"id": 1, "name": "Sensor Temperatura 1", "type": "Temperatura"}, {"id": 2, "name": "Velocitat 1", "type": "Velocitat"}]
+    response = client.get(f"/sensors?limit=2&fields=name&type=Velocitat&cursor={response.json()['next_cursor']}")
+    assert response.status_code == 200
+    assert response.json() == {"sensors": [{"id": 3, "name": "Velocitat 2"}], "next_cursor": None}
+
+def test_get_sensors_invalid_cursor():
+    response = client.get("/sensors?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+def test_create_sensors_bulk():
+    sensor = {"latitude": 5.0, "longitude": 5.0, "type": "Bulk", "manufacturer": "Dummy", "model": "Dummy Bulk", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor creat en bloc"}
+    response = client.post("/sensors/bulk", json=[
+        dict(sensor, name="Bulk 1", mac_address="00:00:00:00:01:01"),
+        dict(sensor, name="Velocitat 1", mac_address="00:00:00:00:01:02"),
+        dict(sensor, name="Bulk 2", mac_address="00:00:00:00:01:01"),
+        dict(sensor, name="Bulk 3", mac_address="00:00:00:00:01:03")])
+    assert response.status_code == 200
+    results = response.json()["sensors"]
+    assert [result["status"] for result in results] == ["created", "error", "error", "created"]
+    assert client.get(f"/sensors/{results[3]['id']}").json()["name"] == "Bulk 3"
+    response = client.get("/sensors/quantity_by_type")
+    assert {"type": "Bulk", "quantity": 2} in response.json()["sensors"]
+
+def test_quantity_by_type_cached_and_invalidated():
+    first = client.get("/sensors/quantity_by_type")
+    redis_client = RedisClient(host="redis")
+    assert redis_client.keys("cache:get_sensors_quantity:*")
+    client.post("/sensors/bulk", json=[{"name": "Bulk Cache", "latitude": 5.0, "longitude": 5.0, "type": "Bulk", "mac_address": "00:00:00:00:01:04", "manufacturer": "Dummy", "model": "Dummy Bulk", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor creat en bloc"}])
+    assert not redis_client.keys("cache:get_sensors_quantity:*")
+    redis_client.close()
+    second = client.get("/sensors/quantity_by_type")
+    assert {"type": "Bulk", "quantity": 3} in second.json()["sensors"]
+    assert first.json() != second.json()
+
+def test_reconcile_sensor_quantities():
+    redis_client = RedisClient(host="redis")
+    redis_client.pipeline().sadd("sensor:type:Temperatura", 9001, 9002).execute()
+    redis_client.close()
+    response = client.post("/admin/quantities/reconcile")
+    assert response.status_code == 200
+    assert response.json()["Temperatura"] == 2
+    response = client.get("/sensors/quantity_by_type")
+    assert {"type": "Temperatura", "quantity": 2} in response.json()["sensors"]
+
+def test_backfill_ndjson(tmp_path):
+    from backfill.__main__ import main
+    source = tmp_path / "lectures.ndjson"
+    source.write_text("\n".join([
+        json.dumps({"id": 1, "temperature": 2.0, "battery_level": 0.5, "last_seen": "2019-06-01T00:00:00"}),
+        json.dumps({"id": 99, "temperature": 3.0, "battery_level": 0.7, "last_seen": "2019-06-01T00:00:00"}),
+        json.dumps({"id": 99, "temperature": 4.0, "battery_level": 0.6, "last_seen": "2019-06-02T00:00:00"}),
+        json.dumps({"id": 99, "temperature": 5.0, "last_seen": "2019-06-03T00:00:00"}),
+    ]) + "\n")
+    state = main([str(source), "--batch-size", "2"])
+    assert (state["position"], state["loaded"], state["rejected"]) == (4, 3, 1)
+    assert main([str(source)])["loaded"] == 3
+    ts = Timescale()
+    ts.execute("SELECT count(*) FROM sensor_data WHERE id = 99")
+    assert ts.getCursor().fetchone()[0] == 2
+    ts.close()
+    redis_client = RedisClient(host="redis")
+    assert json.loads(redis_client.get(99))["temperature"] == 4.0
+    assert json.loads(redis_client.get(1))["last_seen"] != "2019-06-01T00:00:00"
+    redis_client.close()
+
+def test_post_sensor_data_invalid():
+    response = client.post("/sensors/1/data", json={"temperature": "calent", "last_seen": "2020-01-01T00:00:00.000Z"})
+    assert response.status_code == 422
+    assert [error["loc"] for error in response.json()["detail"]] == [["body", "temperature"], ["body", "battery_level"]]
+
+def test_rule_engine_alerts():
+    from consumer.rules import RuleEngine
+    published = []
+    rules = RuleEngine(lambda sensor_id: {"id": sensor_id, "type": "Temperatura", "thresholds": {"temperature": {"max": 40.0}}}, published.append)
+    for i in range(30):
+        assert rules.evaluate(1, {"temperature": 20.0 + i % 2, "battery_level": 0.9 + i % 2 / 100, "last_seen": f"2020-01-01T00:00:{i:02d}"}) == []
+    alerts = rules.evaluate(1, {"temperature": 45.0, "battery_level": 0.1, "last_seen": "2020-01-01T00:01:00"})
+    assert sorted((alert["rule"], alert["metric"]) for alert in alerts) == [("anomaly", "battery_level"), ("anomaly", "temperature"), ("threshold", "battery_level"), ("threshold", "temperature")]
+    assert len(published) == 4
+    assert rules.evaluate(1, {"temperature": 46.0, "battery_level": 0.1, "last_seen": "2020-01-01T00:01:01"}) == []
+
+def test_get_sensor_clusters():
+    response = client.get("/sensors/clusters?min_latitude=0&min_longitude=0&max_latitude=3&max_longitude=3&zoom=2")
+    assert response.status_code == 200
+    clusters = response.json()["clusters"]
+    assert len(clusters) == 1
+    assert clusters[0]["geohash"] == "s"
+    assert clusters[0]["latest"]["sensors_with_data"] <= clusters[0]["count"]
+    response = client.get("/sensors/clusters?min_latitude=0&min_longitude=0&max_latitude=3&max_longitude=3&zoom=9&summary=false")
+    assert response.status_code == 200
+    assert sum(cluster["count"] for cluster in response.json()["clusters"]) == clusters[0]["count"]
+    assert all("latest" not in cluster for cluster in response.json()["clusters"])
+
+def test_get_sensor_clusters_bbox_too_large():
+    response = client.get("/sensors/clusters?min_latitude=-90&min_longitude=-180&max_latitude=90&max_longitude=180&zoom=12")
+    assert response.status_code == 400
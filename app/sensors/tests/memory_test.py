@@ -0,0 +1,83 @@
+# Proves amb els backends en memòria, sense el docker-compose:
+#   BACKENDS=memory python -m pytest app/sensors/tests/memory_test.py
+# La configuració dels backends es llegeix en importar-los, per això BACKENDS s'ha de fixar abans d'importar l'API
+import json
+import os
+os.environ.setdefault("BACKENDS", "memory")
+
+from fastapi.testclient import TestClient
+import pytest
+
+from shared import backends
+
+if not backends.MEMORY:
+    pytest.skip("cal BACKENDS=memory i que shared.backends no s'hagi importat abans", allow_module_level=True)
+
+from app.main import app
+
+client = TestClient(app)
+
+SENSOR = {"name": "Memòria 1", "latitude": 41.38, "longitude": 2.17, "type": "Temperatura", "mac_address": "memory:00:01",
+          "manufacturer": "Dummy", "model": "Dummy Temp", "serie_number": "0000 0000 0000 0001", "firmware_version": "1.0",
+          "description": "Sensor de proves amb els backends en memòria"}
+
+def test_memory_backends():
+    from shared.memory.cassandra_client import MemoryCassandraClient
+    from shared.memory.timescale import MemoryTimescale
+    from shared.sensors import repository
+    cassandra = MemoryCassandraClient()
+    repository.write_cassandra_battery(cassandra, {"id": 1000, "data": {"battery_level": 0.1}})
+    rows = cassandra.execute("SELECT id, battery_level FROM sensor.battery WHERE battery_level < 0.2 ALLOW FILTERING;")
+    assert [(row.id, row.battery_level) for row in rows if row.id == 1000] == [(1000, 0.1)]
+    repository.delete_cassandra_sensor(cassandra, {"id": 1000, "type": "Temperatura"})
+    assert all(row.id != 1000 for row in cassandra.execute("SELECT id, battery_level FROM sensor.battery WHERE battery_level < 0.2 ALLOW FILTERING;"))
+    timescale = MemoryTimescale()
+    timescale.insert_sensor_data(1000, 20.0, None, None, 0.5, "2020-01-01T00:10:00.000Z")
+    timescale.insert_sensor_data(1000, 22.0, None, None, 0.7, "2020-01-01T00:50:00.000Z")
+    timescale.insert_sensor_data(1000, 30.0, None, None, 0.9, "2020-01-01T01:10:00.000Z")
+    rows = timescale.get_bucketed_data(1000, "2020-01-01T00:00:00.000Z", "2020-01-02T00:00:00.000Z", "hour")
+    assert [(row[1].hour, row[3], row[4]) for row in rows] == [(0, 21.0, None), (1, 30.0, None)]
+
+def test_smoke():
+    response = client.post("/sensors", json=SENSOR)
+    assert response.status_code == 200
+    sensor_id = response.json()["id"]
+
+    response = client.post(f"/sensors/{sensor_id}/data", json={"temperature": 21.5, "humidity": 40.0, "battery_level": 0.1, "last_seen": "2020-01-01T00:00:00.000Z"})
+    assert response.status_code == 200
+
+    response = client.get(f"/sensors/{sensor_id}/data")
+    assert response.status_code == 200
+    assert response.json()["temperature"] == 21.5
+
+    response = client.get("/sensors/quantity_by_type")
+    assert response.status_code == 200
+    assert {"type": "Temperatura", "quantity": 1} in response.json()["sensors"]
+
+    response = client.get("/sensors/clusters?min_latitude=41&min_longitude=2&max_latitude=42&max_longitude=3&zoom=6")
+    assert response.status_code == 200
+    clusters = response.json()["clusters"]
+    assert sum(cluster["count"] for cluster in clusters) == 1
+    assert clusters[0]["latest"]["sensors_with_data"] == 1
+
+    response = client.get("/sensors/low_battery")
+    assert response.status_code == 200
+    assert sensor_id in [sensor["id"] for sensor in response.json()["sensors"]]
+
+def test_retry_older_reading_keeps_latest():
+    from shared.database import SessionLocal
+    from shared.sensors import models
+    sensor_id = client.post("/sensors", json={**SENSOR, "name": "Memòria 2", "mac_address": "memory:00:02"}).json()["id"]
+    older = {"temperature": 10.0, "humidity": 40.0, "velocity": None, "battery_level": 0.5, "last_seen": "2020-01-01T00:00:00.000Z"}
+    db = SessionLocal()
+    db.add(models.FailedWrite(operation="redis.set_data", payload=json.dumps({"id": sensor_id, "data": older}), error="ConnectionError()"))
+    db.commit()
+    db.close()
+    response = client.post(f"/sensors/{sensor_id}/data", json={"temperature": 30.0, "humidity": 40.0, "battery_level": 0.5, "last_seen": "2020-01-01T00:05:00.000Z"})
+    assert response.status_code == 200
+
+    response = client.post("/admin/failed_writes/retry")
+    assert response.status_code == 200
+    response = client.get(f"/sensors/{sensor_id}/data")
+    assert response.json()["temperature"] == 30.0
+    assert response.json()["last_seen"] == "2020-01-01T00:05:00.000Z"
@@ -0,0 +1,89 @@
+"""
+Servidor de producció amb diversos workers:
+
+    python -m app.server
+
+Les migracions s'apliquen un sol cop al procés principal, l'aplicació es carrega abans del fork
+(PRELOAD_APP=0 ho desactiva) i cada worker obre les seves pròpies connexions amb els backends. Un
+SIGHUP al procés principal reinicia els workers de manera ordenada, sense tallar les peticions en
+curs; el codi només es torna a carregar si l'aplicació no està precarregada.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+from app.migrations import apply_migrations
+from shared import backends
+
+
+def worker_count():
+    return int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+
+def size_pools(workers):
+    # Repartim el màxim de connexions de cada base de dades entre els workers
+    db_connections = int(os.environ.get("DB_MAX_CONNECTIONS", 90))
+    ts_connections = int(os.environ.get("TS_MAX_CONNECTIONS", 90))
+    os.environ.setdefault("DB_POOL_SIZE", str(max(1, db_connections // (2 * workers))))
+    os.environ.setdefault("DB_MAX_OVERFLOW", str(max(0, db_connections // (2 * workers))))
+    os.environ.setdefault("TS_POOL_SIZE", str(max(1, ts_connections // workers)))
+    os.environ.setdefault("WRITE_POOL_SIZE", str(max(4, 4 * multiprocessing.cpu_count() // workers)))
+
+
+def post_fork(server, worker):
+    # Per si el procés principal ha obert connexions abans del fork, el worker no les ha de fer servir
+    from shared.database import engine
+    engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+        return app
+
+
+def main():
+    if not backends.MEMORY:
+        apply_migrations()
+    os.environ["SKIP_MIGRATIONS"] = "1"
+
+    # Els backends en memòria són de cada procés, amb diversos workers cadascun veuria dades diferents
+    workers = 1 if backends.MEMORY else worker_count()
+    size_pools(workers)
+
+    # Les mètriques de tots els workers s'agreguen des d'aquest directori
+    metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-"))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+    Server({
+        "bind": os.environ.get("BIND", "0.0.0.0:8000"),
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        # Amb l'aplicació precarregada un SIGHUP només recarrega la configuració: els workers nous es creen a partir
+        # del codi ja importat. Amb PRELOAD_APP=0 cada worker importa l'aplicació i un SIGHUP també recarrega el codi
+        "preload_app": os.environ.get("PRELOAD_APP", "1") == "1",
+        "graceful_timeout": int(os.environ.get("GRACEFUL_TIMEOUT", 30)),
+        "post_fork": post_fork,
+        "child_exit": child_exit,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Torna a carregar lectures històriques a TimescaleDB, Cassandra i Redis des d'un arxiu NDJSON, CSV o Parquet.
+
+    python -m backfill lectures.ndjson.gz --batch-size 10000 --rate 50000
+    python -m backfill lectures.csv --only timescale --rejects rebutjades.ndjson
+
+Cada fila té el camp id del sensor i els camps de schemas.SensorData. El progrés es guarda a
+<arxiu>.checkpoint.json i, si es torna a executar amb el mateix arxiu, continua on s'havia quedat.
+"""
+import argparse
+import functools
+import logging
+import os
+
+from backfill.loader import backfill, load_cassandra, load_redis, load_timescale
+from backfill.readers import FORMATS, detect_format
+from shared.cache import invalidate
+
+SINKS = ("timescale", "cassandra", "redis")
+
+
+def open_sinks(names, host=None, cassandra_concurrency=100):
+    # Un client per sink, cada un l'escriu un sol fil alhora
+    clients, sinks = [], {}
+    if "timescale" in names:
+        from shared.timescale import Timescale
+        timescale = Timescale()
+        clients.append(timescale)
+        sinks["timescale"] = functools.partial(load_timescale, timescale)
+    if "cassandra" in names:
+        from shared.cassandra_client import CassandraClient
+        cassandra_client = CassandraClient([host or "cassandra"])
+        clients.append(cassandra_client)
+        sinks["cassandra"] = functools.partial(load_cassandra, cassandra_client, concurrency=cassandra_concurrency)
+    if "redis" in names:
+        from shared.redis_client import RedisClient
+        redis = RedisClient(host=host or "redis")
+        clients.append(redis)
+        sinks["redis"] = functools.partial(load_redis, redis)
+    return clients, sinks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="backfill")
+    parser.add_argument("source", help="Arxiu .ndjson/.jsonl/.csv (opcionalment .gz) o .parquet")
+    parser.add_argument("--format", choices=FORMATS, help="Per defecte es dedueix de l'extensió")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--rate", type=float, help="Màxim de files per segon, per defecte sense límit")
+    parser.add_argument("--only", nargs="*", choices=SINKS, default=SINKS, help="Backends a carregar")
+    parser.add_argument("--checkpoint", help="Fitxer de checkpoint, per defecte <source>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignora el checkpoint i comença des del principi")
+    parser.add_argument("--rejects", help="Fitxer NDJSON on es guarden les files rebutjades i el motiu")
+    parser.add_argument("--cassandra-concurrency", type=int, default=100)
+    parser.add_argument("--host", help="Host per a Cassandra i Redis, per defecte els noms del docker-compose")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    # La invalidació final de la cache llegeix l'host de Redis de REDIS_HOST
+    if args.host:
+        os.environ["REDIS_HOST"] = args.host
+    checkpoint = args.checkpoint or args.source + ".checkpoint.json"
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    clients, sinks = open_sinks(args.only, host=args.host, cassandra_concurrency=args.cassandra_concurrency)
+    rejects = open(args.rejects, "a") if args.rejects else None
+    try:
+        state = backfill(args.source, args.format or detect_format(args.source), sinks,
+                         batch_size=args.batch_size, rate=args.rate, checkpoint=checkpoint, rejects=rejects)
+    finally:
+        if rejects:
+            rejects.close()
+        for client in clients:
+            client.close()
+    # Les respostes de dades en memòria cau poden haver quedat velles
+    invalidate("sensor_data")
+    return state
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backfill.readers import COLUMNS, parse_time, read_batches, validate_batch
+
+logger = logging.getLogger(__name__)
+
+INSERT_TEMPERATURE = "INSERT INTO sensor.temperature(id, temperature) VALUES (?, ?);"
+INSERT_BATTERY = "INSERT INTO sensor.battery(id, battery_level) VALUES (?, ?);"
+
+
+class RateLimiter:
+    """Limita el ritme global a rate files per segon (None o 0 vol dir sense límit)."""
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.rows = 0
+
+    def wait(self, rows):
+        self.rows += rows
+        if not self.rate:
+            return
+        delay = self.rows / self.rate - (time.monotonic() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def load_checkpoint(path, source):
+    if path and os.path.exists(path):
+        with open(path) as checkpoint:
+            state = json.load(checkpoint)
+        if state["source"] == source:
+            return state
+    return {"source": source, "position": 0, "loaded": 0, "rejected": 0}
+
+
+def save_checkpoint(path, state):
+    # Escrivim a un temporal i el reanomenem, així un tall a mitges no deixa el checkpoint corrupte
+    if not path:
+        return
+    with open(path + ".tmp", "w") as checkpoint:
+        json.dump(state, checkpoint)
+    os.replace(path + ".tmp", path)
+
+
+def load_timescale(timescale, rows):
+    timescale.copy_sensor_data(rows)
+
+
+def load_cassandra(cassandra_client, rows, concurrency=100):
+    temperatures = [(row[0], row[1]) for row in rows if row[1] is not None]
+    if temperatures:
+        cassandra_client.execute_concurrent(INSERT_TEMPERATURE, temperatures, concurrency=concurrency)
+    cassandra_client.execute_concurrent(INSERT_BATTERY, [(row[0], row[4]) for row in rows], concurrency=concurrency)
+
+
+def load_redis(redis, rows):
+    # Redis només guarda l'última lectura de cada sensor, i no la trepitgem si la que ja hi ha és més nova
+    latest = {}
+    for row in rows:
+        if row[0] not in latest or row[5] > latest[row[0]][5]:
+            latest[row[0]] = row
+    ids = list(latest)
+
+    pipe = redis.pipeline()
+    for sensor_id in ids:
+        pipe.get(sensor_id)
+    current = pipe.execute()
+
+    pipe = redis.pipeline()
+    for sensor_id, value in zip(ids, current):
+        row = latest[sensor_id]
+        if value is not None and parse_time(json.loads(value)["last_seen"]) >= row[5]:
+            continue
+        data = dict(zip(COLUMNS[1:], row[1:]))
+        data["last_seen"] = row[5].isoformat()
+        pipe.set(sensor_id, json.dumps(data))
+    pipe.execute()
+
+
+def backfill(source, fmt, sinks, batch_size=10000, rate=None, checkpoint=None, rejects=None):
+    """
+    Carrega l'arxiu source a tots els sinks {nom: funció(files)} en paral·lel, lot a lot.
+
+    Mentre s'escriu un lot es llegeix i es valida el següent. El checkpoint només avança quan
+    tots els sinks han acabat el lot, així en reprendre no es perd cap fila (les escriptures són idempotents).
+    Les files rebutjades d'un lot s'escriuen a rejects just després del seu checkpoint, perquè en reprendre
+    no es tornin a afegir.
+    """
+    state = load_checkpoint(checkpoint, os.path.abspath(source))
+    if state["position"]:
+        logger.info("Resuming %s from record %d", source, state["position"])
+    limiter = RateLimiter(rate)
+    start, resumed_at = time.monotonic(), state["loaded"]
+    pending = None
+
+    def finish(position, futures, loaded, rejected):
+        for future in futures:
+            future.result()
+        state.update(position=position, loaded=state["loaded"] + loaded, rejected=state["rejected"] + len(rejected))
+        save_checkpoint(checkpoint, state)
+        if rejects:
+            for record, reason in rejected:
+                rejects.write(json.dumps({"record": record, "reason": reason}, default=str) + "\n")
+            rejects.flush()
+        logger.info("%d records read, %d loaded, %d rejected (%.0f rows/s)",
+                    state["position"], state["loaded"], state["rejected"], (state["loaded"] - resumed_at) / (time.monotonic() - start))
+
+    with ThreadPoolExecutor(max_workers=len(sinks), thread_name_prefix="backfill") as executor:
+        for position, records in read_batches(source, fmt, batch_size, skip=state["position"]):
+            rows, rejected = validate_batch(records)
+            limiter.wait(len(records))
+
+            if pending:
+                finish(*pending)
+            futures = [executor.submit(sink, rows) for sink in sinks.values()] if rows else []
+            pending = (position, futures, len(rows), rejected)
+        if pending:
+            finish(*pending)
+    return state
@@ -0,0 +1,126 @@
+import csv
+import datetime
+import gzip
+import itertools
+import json
+
+from shared.sensors.schemas import SensorData
+
+FORMATS = ("ndjson", "csv", "parquet")
+
+# Ordre de les columnes tal com es copien a sensor_data
+COLUMNS = ("id", "temperature", "humidity", "velocity", "battery_level", "last_seen")
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".parquet"):
+        return "parquet"
+    raise ValueError(f"Unknown format for {path}, use --format")
+
+
+def open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="")
+    return open(path, newline="")
+
+
+def chunks(records, batch_size, skip):
+    # Retorna (posició, lot) on la posició és el nombre de registres de l'arxiu ja llegits en acabar el lot
+    position = skip
+    records = itertools.islice(records, skip, None)
+    while batch := list(itertools.islice(records, batch_size)):
+        position += len(batch)
+        yield position, batch
+
+
+def read_ndjson(path: str):
+    with open_text(path) as source:
+        for line in source:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield record if isinstance(record, dict) else {"_error": "invalid JSON", "_line": line.rstrip("\n")}
+
+
+def read_csv(path: str):
+    with open_text(path) as source:
+        yield from csv.DictReader(source)
+
+
+def read_parquet(path: str, batch_size: int):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Reading Parquet requires pyarrow (pip install pyarrow)")
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_batches(path: str, fmt: str, batch_size: int, skip: int = 0):
+    """Llegeix l'arxiu en streaming i el retorna en lots de com a molt batch_size registres, saltant-se els skip primers."""
+    if fmt == "ndjson":
+        records = read_ndjson(path)
+    elif fmt == "csv":
+        records = read_csv(path)
+    elif fmt == "parquet":
+        records = read_parquet(path, batch_size)
+    else:
+        raise ValueError(f"Unknown format {fmt}")
+    return chunks(records, batch_size, skip)
+
+
+def parse_time(value) -> datetime.datetime:
+    # Com la columna timestamp de TimescaleDB, ignorem la zona horària
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(value)
+    return value.replace(tzinfo=None)
+
+
+def to_float(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def to_int(value):
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def convert_column(values, convert, errors, name, required):
+    # Convertim tota la columna d'un cop i només marquem les files que fallen
+    converted = []
+    for i, value in enumerate(values):
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            errors[i] = errors[i] or f"invalid {name}"
+            value = None
+        if value is None and required:
+            errors[i] = errors[i] or f"missing {name}"
+        converted.append(value)
+    return converted
+
+
+def validate_batch(records: list[dict]):
+    """
+    Valida un lot contra schemas.SensorData columna a columna en lloc de crear un model per fila.
+
+    Retorna les files vàlides com a tuples en l'ordre de COLUMNS i les rebutjades com a (registre, motiu).
+    """
+    errors = [record.get("_error") for record in records]
+    columns = {"id": convert_column([record.get("id") for record in records], to_int, errors, "id", True)}
+    for name, field in SensorData.__fields__.items():
+        convert = parse_time if name == "last_seen" else to_float
+        columns[name] = convert_column([record.get(name) for record in records], convert, errors, name, field.required)
+
+    rows = [row for row, error in zip(zip(*(columns[name] for name in COLUMNS)), errors) if error is None]
+    rejected = [(record, error) for record, error in zip(records, errors) if error is not None]
+    return rows, rejected
@@ -0,0 +1,76 @@
+"""
+Benchmarks de l'API i dels clients de shared/.
+
+    python -m benchmarks api --base-url http://localhost:8000 --requests 1000 --concurrency 16 --output api.json
+    python -m benchmarks clients --requests 1000 --concurrency 16 --only redis cassandra --output clients.json
+    python -m benchmarks codec --requests 100000 --output codec.json
+    python -m benchmarks profile --requests 500 --concurrency 8 --profile-dir profiles --output profile.json
+    python -m benchmarks compare baseline.json api.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+
+from benchmarks.api import run_api
+from benchmarks.clients import run_clients
+from benchmarks.codec import run_codec
+from benchmarks.profile import run_profile
+from benchmarks.runner import compare
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    subparsers = parser.add_subparsers(dest="target", required=True)
+
+    for target in ("api", "clients", "codec", "profile"):
+        sub = subparsers.add_parser(target)
+        sub.add_argument("--requests", type=int, default=500)
+        sub.add_argument("--concurrency", type=int, default=8)
+        sub.add_argument("--warmup", type=int, default=10)
+        sub.add_argument("--only", nargs="*", help="Escenaris (api) o backends (clients) a executar")
+        sub.add_argument("--output", help="Fitxer JSON de sortida, per defecte stdout")
+    subparsers.choices["api"].add_argument("--base-url", default="http://localhost:8000")
+    subparsers.choices["clients"].add_argument("--host", help="Host per a tots els backends, per defecte els noms del docker-compose")
+    subparsers.choices["profile"].add_argument("--profile-dir", default="profiles", help="Directori on es guarden les piles (.folded) de cada escenari")
+    subparsers.choices["profile"].add_argument("--interval", type=float, default=5, help="Interval de mostreig en ms")
+    subparsers.choices["profile"].add_argument("--sensors", type=int, default=100, help="Sensors addicionals a crear abans de començar")
+    subparsers.choices["profile"].add_argument("--latency-ms", type=float, help="Latència simulada de cada crida als backends en memòria")
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    args = parser.parse_args(argv)
+
+    if args.target == "compare":
+        with open(args.baseline) as baseline, open(args.current) as current:
+            json.dump(compare(json.load(baseline), json.load(current)), sys.stdout, indent=2)
+        return
+
+    if args.target == "api":
+        results = run_api(args.base_url, args.requests, args.concurrency, only=args.only, warmup=args.warmup)
+    elif args.target == "profile":
+        results = run_profile(args.requests, args.concurrency, args.profile_dir, only=args.only, warmup=args.warmup,
+                              interval=args.interval / 1000, sensors=args.sensors, latency_ms=args.latency_ms)
+    elif args.target == "codec":
+        results = run_codec(args.requests, only=args.only, warmup=args.warmup)
+    else:
+        results = run_clients(args.requests, args.concurrency, only=args.only, host=args.host, warmup=args.warmup)
+
+    report = {
+        "target": args.target,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
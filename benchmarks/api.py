@@ -0,0 +1,53 @@
+import datetime
+import json
+import uuid
+
+import httpx
+
+from benchmarks.runner import run
+
+
+def create_sensor(client, sensor_type):
+    # Cada execucio crea el seu propi sensor per no trepitjar dades existents
+    suffix = uuid.uuid4().hex[:12]
+    response = client.post("/sensors", json={
+        "name": f"Benchmark {sensor_type} {suffix}", "latitude": 41.38, "longitude": 2.17, "type": sensor_type,
+        "mac_address": f"bench:{suffix}", "manufacturer": "Benchmark", "model": "Benchmark",
+        "serie_number": suffix, "firmware_version": "1.0", "description": "Sensor creat pel benchmark"})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def reading(i, base=datetime.datetime(2020, 1, 1)):
+    last_seen = base + datetime.timedelta(seconds=i)
+    return {"temperature": 20.0 + i % 10, "humidity": 50.0, "battery_level": 0.1 + (i % 10) / 10,
+            "last_seen": last_seen.isoformat() + ".000Z"}
+
+
+def scenarios(client, sensor_id):
+    def check(response):
+        response.raise_for_status()
+
+    return {
+        "post_data": lambda i: check(client.post(f"/sensors/{sensor_id}/data", json=reading(i))),
+        "get_data_latest": lambda i: check(client.get(f"/sensors/{sensor_id}/data")),
+        "get_data_bucketed": lambda i: check(client.get(f"/sensors/{sensor_id}/data", params={
+            "from": "2020-01-01T00:00:00.000Z", "to": "2020-01-02T00:00:00.000Z", "bucket": "hour"})),
+        "near": lambda i: check(client.get("/sensors/near", params={"latitude": 41.38, "longitude": 2.17, "radius": 0.5})),
+        "search": lambda i: check(client.get("/sensors/search", params={"query": json.dumps({"type": "Temperatura"})})),
+        "temperature_values": lambda i: check(client.get("/sensors/temperature/values")),
+        "low_battery": lambda i: check(client.get("/sensors/low_battery")),
+    }
+
+
+def run_api(base_url, requests, concurrency, only=None, warmup=0):
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        sensor_id = create_sensor(client, "Temperatura")
+        # post_data va primer perque la resta d'escenaris tinguin dades per llegir
+        results = []
+        for name, operation in scenarios(client, sensor_id).items():
+            if only and name not in only:
+                continue
+            results.append(run(name, operation, requests, concurrency, warmup=warmup))
+        client.delete(f"/sensors/{sensor_id}")
+    return results
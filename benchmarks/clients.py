@@ -0,0 +1,167 @@
+import datetime
+import json
+import os
+import threading
+import uuid
+
+from benchmarks.runner import run
+
+
+class PerThread:
+    # Els clients que no son thread-safe (psycopg2, pika) es creen un cop per fil
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+        self.created = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.factory()
+            with self.lock:
+                self.created.append(client)
+        return client
+
+    def close(self):
+        for client in self.created:
+            client.close()
+
+
+class BenchmarkPayload:
+    def __init__(self, i):
+        self.benchmark = i
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+
+def redis_scenarios(host):
+    from shared.redis_client import RedisClient
+    client = RedisClient(host=host)
+    prefix = "benchmark:" + uuid.uuid4().hex[:8]
+    scenarios = {
+        "redis_set": lambda i: client.set(f"{prefix}:{i}", json.dumps({"temperature": i})),
+        "redis_get": lambda i: client.get(f"{prefix}:{i}"),
+    }
+
+    def cleanup():
+        for key in client.keys(prefix + ":*"):
+            client.delete(key)
+        client.close()
+    return scenarios, cleanup
+
+
+def mongodb_scenarios(host):
+    from shared.mongodb_client import MongoDBClient
+    client = MongoDBClient(host=host)
+    collection = client.getDatabase("benchmark")["sensors"]
+    scenarios = {
+        "mongodb_insert": lambda i: collection.insert_one({"id": i, "name": f"Benchmark {i}"}),
+        "mongodb_find_one": lambda i: collection.find_one({"id": i}, {"_id": 0}),
+    }
+
+    def cleanup():
+        client.clearDb("benchmark")
+        client.close()
+    return scenarios, cleanup
+
+
+def cassandra_scenarios(host):
+    from shared.cassandra_client import CassandraClient
+    client = CassandraClient([host])
+    session = client.get_session()
+    session.execute("CREATE TABLE IF NOT EXISTS sensor.benchmark(id int PRIMARY KEY, temperature float);")
+    insert = session.prepare("INSERT INTO sensor.benchmark(id, temperature) VALUES (?, ?)")
+    select = session.prepare("SELECT id, temperature FROM sensor.benchmark WHERE id = ?")
+    scenarios = {
+        "cassandra_insert": lambda i: session.execute(insert, (i, float(i))),
+        "cassandra_select": lambda i: session.execute(select, (i,)).one(),
+    }
+
+    def cleanup():
+        session.execute("DROP TABLE IF EXISTS sensor.benchmark;")
+        client.close()
+    return scenarios, cleanup
+
+
+def timescale_scenarios(host):
+    from shared.timescale import Timescale
+    # El pool de Timescale llegeix l'host de TS_HOST en crear-se
+    if host:
+        os.environ["TS_HOST"] = host
+    clients = PerThread(Timescale)
+    # Ids negatius per no barrejar-nos amb sensors reals
+    sensor_id = -1
+    base = datetime.datetime(2020, 1, 1)
+    scenarios = {
+        "timescale_insert": lambda i: clients.get().insert_sensor_data(sensor_id, 20.0, 50.0, None, 1.0, base + datetime.timedelta(seconds=i)),
+        "timescale_bucketed": lambda i: clients.get().get_bucketed_data(sensor_id, "2020-01-01", "2020-01-02", "hour"),
+    }
+
+    def cleanup():
+        ts = clients.get()
+        ts.execute("DELETE FROM sensor_data WHERE id = %s", (sensor_id,))
+        ts.commit()
+        clients.close()
+    return scenarios, cleanup
+
+
+def elasticsearch_scenarios(host):
+    from shared.elasticsearch_client import ElasticsearchClient
+    client = ElasticsearchClient(host=host)
+    index_name = "benchmark"
+    client.clearIndex(index_name)
+    client.create_index(index_name)
+    scenarios = {
+        "elasticsearch_index": lambda i: client.index_document(index_name, {"name": f"Benchmark {i}", "type": "Temperatura"}),
+        "elasticsearch_search": lambda i: client.search(index_name, {"query": {"match": {"type": "Temperatura"}}, "size": 10}),
+    }
+
+    def cleanup():
+        client.clearIndex(index_name)
+        client.close()
+    return scenarios, cleanup
+
+
+def rabbitmq_scenarios(host):
+    from shared.publisher import Publisher, QUEUE_NAME
+    if host:
+        os.environ["RABBITMQ_HOST"] = host
+    from shared.subscriber import Subscriber
+    publishers = PerThread(Publisher)
+    subscribers = PerThread(Subscriber)
+    scenarios = {
+        "rabbitmq_publish": lambda i: publishers.get().publish(BenchmarkPayload(i)),
+        "rabbitmq_consume": lambda i: subscribers.get().channel.basic_get(QUEUE_NAME, auto_ack=True),
+    }
+
+    def cleanup():
+        publishers.close()
+        subscribers.close()
+    return scenarios, cleanup
+
+
+BACKENDS = {
+    "redis": (redis_scenarios, "redis"),
+    "mongodb": (mongodb_scenarios, "mongodb"),
+    "cassandra": (cassandra_scenarios, "cassandra"),
+    # Sense --host, Timescale i RabbitMQ fan servir TS_HOST i RABBITMQ_HOST
+    "timescale": (timescale_scenarios, None),
+    "elasticsearch": (elasticsearch_scenarios, "elasticsearch"),
+    "rabbitmq": (rabbitmq_scenarios, None),
+}
+
+
+def run_clients(requests, concurrency, only=None, host=None, warmup=0):
+    results = []
+    for backend, (factory, default_host) in BACKENDS.items():
+        if only and backend not in only:
+            continue
+        scenarios, cleanup = factory(host or default_host)
+        try:
+            for name, operation in scenarios.items():
+                results.append(run(name, operation, requests, concurrency, warmup=warmup))
+        finally:
+            cleanup()
+    return results
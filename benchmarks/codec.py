@@ -0,0 +1,63 @@
+import json
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+
+from benchmarks.api import reading
+from benchmarks.runner import run
+from shared.sensors import schemas
+from shared.sensors.codec import Reading
+
+
+# Cada escenari fa, sense xarxa ni backends, la feina de CPU que l'API fa per a una lectura
+def ingest_pydantic(body):
+    # Abans: model pydantic, .dict(), json.dumps per a Redis i jsonable_encoder + json.dumps per a la resposta
+    data = schemas.SensorData.parse_raw(body).dict()
+    json.dumps(data)
+    json.dumps(jsonable_encoder(data)).encode()
+
+
+def ingest_codec(body):
+    data = Reading.from_json(body).as_dict()
+    orjson.dumps(data)
+    ORJSONResponse(data)
+
+
+def latest_json(stored):
+    data = json.loads(stored)
+    data["id"], data["name"] = 1, "Benchmark"
+    json.dumps(jsonable_encoder(data)).encode()
+
+
+def latest_codec(stored):
+    data = orjson.loads(stored)
+    data["id"], data["name"] = 1, "Benchmark"
+    ORJSONResponse(data)
+
+
+def scenarios():
+    bodies = [json.dumps(reading(i)).encode() for i in range(1000)]
+    stored = [json.dumps(schemas.SensorData.parse_raw(body).dict()) for body in bodies]
+    return {
+        "ingest_pydantic": lambda i: ingest_pydantic(bodies[i % 1000]),
+        "ingest_codec": lambda i: ingest_codec(bodies[i % 1000]),
+        "latest_json": lambda i: latest_json(stored[i % 1000]),
+        "latest_codec": lambda i: latest_codec(stored[i % 1000]),
+    }
+
+
+def run_codec(requests, only=None, warmup=0):
+    results = []
+    for name, operation in scenarios().items():
+        if only and name not in only:
+            continue
+        result = run(name, operation, requests, 1, warmup=warmup)
+        # El temps de CPU es mesura a part, en un bucle sense el pool de fils del runner
+        start = time.process_time()
+        for i in range(requests):
+            operation(i)
+        result["cpu_us_per_op"] = round((time.process_time() - start) / requests * 1e6, 2)
+        results.append(result)
+    return results
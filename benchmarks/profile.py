@@ -0,0 +1,124 @@
+"""
+Perfil de cada endpoint de l'API sota càrrega, dins del procés i amb els backends en memòria (BACKENDS=memory).
+
+Per a cada escenari de benchmarks.api es mesura la latència (mateix format que la resta de benchmarks, es pot fer
+compare) i un fil mostreja periòdicament les piles de tots els fils. Les mostres es guarden en format "folded"
+(<sortida>/<escenari>.folded), el mateix que genera py-spy record --format raw, i es poden convertir a flame graph
+amb flamegraph.pl o obrir directament a speedscope.
+"""
+import collections
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from benchmarks.api import create_sensor, reading, scenarios
+from benchmarks.runner import run, warm_up
+
+# Fulles de pila on un fil només espera (feina, un lock o l'event loop) i no consumeix temps de l'aplicació.
+# _write_to_self i _read_from_self són els despertars de l'event loop del TestClient entre fils
+IDLE = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selector_events.py", "_write_to_self"),
+    ("selector_events.py", "_read_from_self"),
+}
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.relpath(code.co_filename) if code.co_filename.startswith(os.getcwd()) else os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler(threading.Thread):
+    """Mostreja cada interval segons la pila de tots els fils (temps de paret, com py-spy) i en compta les repeticions."""
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, "w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+    def top(self, limit=10):
+        # Funcions amb més mostres pròpies (a la fulla de la pila), en percentatge del total
+        total = sum(self.stacks.values())
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [{"function": name, "self_pct": round(count / total * 100, 2)} for name, count in leaves.most_common(limit)]
+
+
+def seed_sensors(client, count):
+    # Sensors repartits al voltant del de benchmark perquè near, search i les estadístiques tinguin dades
+    suffix = uuid.uuid4().hex[:8]
+    sensors = [{
+        "name": f"Profile {suffix} {i}", "latitude": 41.38 + random.uniform(-0.5, 0.5), "longitude": 2.17 + random.uniform(-0.5, 0.5),
+        "type": random.choice(["Temperatura", "Velocitat"]), "mac_address": f"profile:{suffix}:{i}", "manufacturer": "Benchmark",
+        "model": "Benchmark", "serie_number": f"{suffix}{i}", "firmware_version": "1.0", "description": "Sensor creat pel profiling"}
+        for i in range(count)]
+    for start in range(0, count, 500):
+        response = client.post("/sensors/bulk", json=sensors[start:start + 500])
+        response.raise_for_status()
+        # Cada sensor amb una lectura, les rutes de llistat esperen que en tinguin
+        for result in response.json()["sensors"]:
+            client.post(f"/sensors/{result['id']}/data", json=reading(result["index"])).raise_for_status()
+
+
+def run_profile(requests, concurrency, outdir, only=None, warmup=0, interval=0.005, sensors=0, latency_ms=None):
+    # La configuració dels backends es llegeix en importar-los, per això l'API s'importa aquí
+    os.environ["BACKENDS"] = "memory"
+    if latency_ms is not None:
+        os.environ["BACKEND_LATENCY_MS"] = str(latency_ms)
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from shared import backends
+    if not backends.MEMORY:
+        raise RuntimeError("shared.backends was imported before BACKENDS=memory was set")
+
+    os.makedirs(outdir, exist_ok=True)
+    results = []
+    with TestClient(app) as client:
+        seed_sensors(client, sensors)
+        sensor_id = create_sensor(client, "Temperatura")
+        # post_data va primer perque la resta d'escenaris tinguin dades per llegir
+        for name, operation in scenarios(client, sensor_id).items():
+            if only and name not in only:
+                continue
+            # L'escalfament es fa abans d'engegar el mostrejador perquè no surti al perfil
+            warmup_errors = warm_up(operation, warmup)
+            sampler = Sampler(interval)
+            sampler.start()
+            start = time.process_time()
+            result = run(name, operation, requests, concurrency)
+            result["warmup_errors"] = warmup_errors
+            # Inclou la CPU del client de proves, que és la mateixa per a tots els escenaris
+            result["cpu_us_per_op"] = round((time.process_time() - start) / requests * 1e6, 2)
+            sampler.stop()
+            path = os.path.join(outdir, f"{name}.folded")
+            sampler.write(path)
+            result["profile"] = {"folded": path, "samples": sum(sampler.stacks.values()), "top": sampler.top()}
+            results.append(result)
+    return results
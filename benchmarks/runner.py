@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, pct):
+    # values ha d'estar ordenada
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(name, latencies, errors, elapsed, concurrency):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "name": name,
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "ops_per_sec": round(total / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": _ms(percentile(latencies, 50)),
+            "p95": _ms(percentile(latencies, 95)),
+            "p99": _ms(percentile(latencies, 99)),
+            "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+            "max": _ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def warm_up(operation, warmup):
+    """Executa operation(i) warmup cops sense mesurar-ho i retorna quantes crides han fallat."""
+    errors = 0
+    for i in range(warmup):
+        try:
+            operation(i)
+        except Exception:
+            errors += 1
+    return errors
+
+
+def run(name, operation, requests, concurrency, warmup=0):
+    """Executa operation(i) requests cops amb concurrency fils i en mesura la latència."""
+    warmup_errors = warm_up(operation, warmup)
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            operation(i)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency in results if latency is not None]
+    result = summarize(name, latencies, len(results) - len(latencies), elapsed, concurrency)
+    result["warmup_errors"] = warmup_errors
+    return result
+
+
+def compare(baseline, current):
+    # Compara dos informes i retorna la variació de p50/p99 i ops/s per a cada escenari
+    base = {result["name"]: result for result in baseline["results"]}
+    diff = []
+    for result in current["results"]:
+        old = base.get(result["name"])
+        if old is None:
+            continue
+        diff.append({
+            "name": result["name"],
+            "p50_change_pct": _change(old["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+            "p99_change_pct": _change(old["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+            "ops_per_sec_change_pct": _change(old["ops_per_sec"], result["ops_per_sec"]),
+        })
+    return diff
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return round((new - old) / old * 100, 2)
@@ -1,13 +1,37 @@
 import json
+import os
 
+import orjson
+from prometheus_client import start_http_server
+
+from consumer.rules import RuleEngine
+from shared.mongodb_client import MongoDBClient
+from shared.publisher import Publisher, ALERTS_QUEUE_NAME, READINGS_QUEUE_NAME
 from shared.subscriber import Subscriber
+from shared.tracing import setup_tracing
+
+# El consumidor no té API, exposem les mètriques en un port propi
+start_http_server(int(os.environ.get("METRICS_PORT", 9100)))
+setup_tracing("consumer")
 
 subscriber = Subscriber()
 
+# Els llindars de cada sensor surten del seu document a MongoDB
+mongodb_client = MongoDBClient(host="mongodb")
+alerts = Publisher(queue_name=ALERTS_QUEUE_NAME)
+rules = RuleEngine(lambda sensor_id: mongodb_client.getDocument({'id': sensor_id}), alerts.publish)
+
 
 def callback(ch, method, properties, body):
     data = json.loads(body)
     print("Received data:", data)
 
 
-subscriber.subscribe(callback)
+def evaluate_reading(ch, method, properties, body):
+    reading = orjson.loads(body)
+    rules.evaluate(reading['id'], reading['data'])
+
+
+subscriber.consume(callback)
+subscriber.consume(evaluate_reading, queue_name=READINGS_QUEUE_NAME)
+subscriber.start()
@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+import time
+
+import pika
+from prometheus_client import start_http_server
+
+from shared.cassandra_client import CassandraClient
+from shared.database import SessionLocal
+from shared.elasticsearch_client import ElasticsearchClient
+from shared.mongodb_client import MongoDBClient
+from shared.publisher import OUTBOX_DEAD_LETTER_QUEUE_NAME, OUTBOX_QUEUE_NAME
+from shared.redis_client import RedisClient
+from shared.sensors import repository
+from shared.subscriber import Subscriber
+from shared.tracing import setup_tracing
+
+logger = logging.getLogger(__name__)
+
+# Aplica els esdeveniments de l'outbox a MongoDB, Elasticsearch, Cassandra i Redis
+start_http_server(int(os.environ.get("METRICS_PORT", 9102)))
+setup_tracing("projector")
+
+clients = {
+    'mongodb': MongoDBClient(host="mongodb"),
+    'elasticsearch': ElasticsearchClient(host="elasticsearch"),
+    'cassandra': CassandraClient(hosts=["cassandra"]),
+    'redis': RedisClient(host="redis"),
+}
+
+# Intents de projectar un esdeveniment abans d'enviar-lo a la cua de dead letter
+MAX_RETRIES = int(os.environ.get("PROJECTOR_MAX_RETRIES", 5))
+RETRY_DELAY = float(os.environ.get("PROJECTOR_RETRY_DELAY", 1))
+
+subscriber = Subscriber(queue_name=OUTBOX_QUEUE_NAME)
+subscriber.channel.queue_declare(queue=OUTBOX_DEAD_LETTER_QUEUE_NAME)
+
+
+def callback(ch, method, properties, body):
+    event = json.loads(body)
+    db = SessionLocal()
+    try:
+        try:
+            repository.project_event(db, event["type"], event["payload"], clients)
+        except Exception:
+            logger.exception("Projection of outbox event %s failed", event["id"])
+            retry(ch, properties, body, event)
+        # Si no s'ha pogut tornar a publicar no fem ack i RabbitMQ el tornarà a entregar
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    finally:
+        db.close()
+
+
+def retry(ch, properties, body, event):
+    # Com que les escriptures són idempotents es pot reprocessar: el tornem a publicar al final de la cua comptant
+    # els intents, i després de MAX_RETRIES el deixem a la cua de dead letter perquè no es reintenti indefinidament
+    headers = dict(properties.headers or {})
+    headers["x-retries"] = headers.get("x-retries", 0) + 1
+    queue_name = OUTBOX_QUEUE_NAME
+    if headers["x-retries"] > MAX_RETRIES:
+        logger.error("Outbox event %s moved to %s after %d attempts", event["id"], OUTBOX_DEAD_LETTER_QUEUE_NAME, headers["x-retries"])
+        queue_name = OUTBOX_DEAD_LETTER_QUEUE_NAME
+    else:
+        time.sleep(RETRY_DELAY)
+    ch.basic_publish(exchange='', routing_key=queue_name, body=body, properties=pika.BasicProperties(headers=headers))
+
+
+subscriber.subscribe(callback, auto_ack=False)
@@ -0,0 +1,44 @@
+import logging
+import os
+import time
+
+from prometheus_client import start_http_server
+
+from shared.database import SessionLocal
+from shared.redis_client import RedisClient
+from shared.publisher import Publisher, OUTBOX_QUEUE_NAME
+from shared.sensors import repository
+from shared.tracing import setup_tracing
+
+logger = logging.getLogger(__name__)
+
+# Publica a la cua els esdeveniments de l'outbox que encara no s'han publicat
+POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
+BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+# Cada quant es tornen a calcular els comptadors de sensors per tipus des de PostgreSQL
+RECONCILE_INTERVAL = float(os.environ.get("QUANTITY_RECONCILE_INTERVAL", 300))
+
+start_http_server(int(os.environ.get("METRICS_PORT", 9101)))
+setup_tracing("relay")
+
+publisher = Publisher(queue_name=OUTBOX_QUEUE_NAME)
+redis = RedisClient(host="redis")
+last_reconcile = 0
+
+while True:
+    db = SessionLocal()
+    published = 0
+    try:
+        published = repository.relay_outbox(db, publisher, limit=BATCH_SIZE)
+        if time.monotonic() - last_reconcile > RECONCILE_INTERVAL:
+            repository.reconcile_sensor_quantities(db, redis)
+            last_reconcile = time.monotonic()
+    except Exception:
+        # Un error de PostgreSQL, RabbitMQ o Redis no ha d'aturar el relay; els esdeveniments segueixen pendents
+        logger.exception("Outbox relay iteration failed")
+        db.rollback()
+    finally:
+        db.close()
+    # Si el lot era ple segur que en queden més, no esperem
+    if published < BATCH_SIZE:
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import orjson
+from prometheus_client import Counter
+
+# Nombre aproximat de lectures que pesen a la mitjana i la variància mòbils (mitjana exponencial)
+WINDOW = int(os.environ.get("ALERT_WINDOW", 100))
+# Lectures mínimes abans d'avaluar anomalies, perquè les estadístiques siguin estables
+MIN_SAMPLES = int(os.environ.get("ALERT_MIN_SAMPLES", 20))
+# Desviacions típiques a partir de les quals una lectura és una anomalia
+Z_THRESHOLD = float(os.environ.get("ALERT_Z_THRESHOLD", 4))
+# Segons que es guarden els llindars d'un sensor abans de tornar-los a llegir de MongoDB
+METADATA_TTL = float(os.environ.get("ALERT_METADATA_TTL", 300))
+
+METRICS = ("velocity", "temperature", "humidity", "battery_level")
+
+# Llindars {tipus: {mètrica: {"min": x, "max": y}}}, "*" s'aplica a tots els tipus. Es poden ampliar amb
+# ALERT_THRESHOLDS (el mateix format en JSON) i, per a un sensor concret, amb el camp thresholds del seu document a MongoDB
+DEFAULT_THRESHOLDS = {"*": {"battery_level": {"min": 0.2}}}
+THRESHOLDS = {**DEFAULT_THRESHOLDS, **json.loads(os.environ.get("ALERT_THRESHOLDS", "{}"))}
+
+ALERTS = Counter("sensor_alerts_total", "Alerts raised by the rule engine", ["rule", "metric"])
+
+
+class RollingStats:
+    """Mitjana i variància mòbils exponencials d'una mètrica, actualitzades a cada lectura."""
+    __slots__ = ("count", "mean", "var")
+
+    alpha = 2 / (WINDOW + 1)
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, value):
+        if self.count == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.var = (1 - self.alpha) * (self.var + diff * increment)
+        self.count += 1
+
+    def zscore(self, value):
+        if self.count < MIN_SAMPLES or self.var <= 0:
+            return None
+        return (value - self.mean) / self.var ** 0.5
+
+
+class SensorState:
+    __slots__ = ("stats", "last", "last_seen", "thresholds", "loaded_at", "active")
+
+    def __init__(self):
+        self.stats = {}
+        self.last = None
+        self.last_seen = None
+        self.thresholds = {}
+        self.loaded_at = None
+        # Alertes obertes (regla, mètrica), no es tornen a enviar fins que la lectura torna a ser normal
+        self.active = set()
+
+
+class AlertMessage():
+    def __init__(self, alert: dict):
+        self.alert = alert
+
+    def to_json(self):
+        return orjson.dumps(self.alert)
+
+
+def seen_at(data: dict) -> datetime | None:
+    # Comparem instants i no strings: "...Z" i "...+00:00" o precisions de fraccions diferents ordenarien malament
+    try:
+        value = datetime.fromisoformat(data["last_seen"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def merge_thresholds(sensor: dict | None) -> dict:
+    thresholds = {metric: dict(limits) for metric, limits in THRESHOLDS["*"].items()}
+    if sensor:
+        for source in (THRESHOLDS.get(sensor.get("type"), {}), sensor.get("thresholds") or {}):
+            for metric, limits in source.items():
+                thresholds.setdefault(metric, {}).update(limits)
+    return thresholds
+
+
+class RuleEngine:
+    """
+    Avalua cada lectura a mesura que arriba amb l'estat en memòria del sensor.
+
+    load_metadata(sensor_id) retorna el document del sensor (o None) i publish(missatge) envia les alertes.
+    L'estat és per procés: totes les lectures d'un sensor han d'arribar al mateix consumidor.
+    """
+    def __init__(self, load_metadata, publish, clock=time.monotonic):
+        self.load_metadata = load_metadata
+        self.publish = publish
+        self.clock = clock
+        self.sensors = {}
+
+    def state(self, sensor_id: int) -> SensorState:
+        state = self.sensors.get(sensor_id)
+        if state is None:
+            state = self.sensors[sensor_id] = SensorState()
+        now = self.clock()
+        if state.loaded_at is None or now - state.loaded_at > METADATA_TTL:
+            state.thresholds = merge_thresholds(self.load_metadata(sensor_id))
+            state.loaded_at = now
+        return state
+
+    def evaluate(self, sensor_id: int, data: dict) -> list[dict]:
+        state = self.state(sensor_id)
+        # Les lectures que arriben tard (p.ex. reintents des de failed_writes) no alteren l'estat
+        last_seen = seen_at(data)
+        if last_seen is not None and state.last_seen is not None and last_seen < state.last_seen:
+            return []
+        alerts = []
+        for metric in METRICS:
+            value = data.get(metric)
+            if value is None:
+                continue
+            stats = state.stats.get(metric)
+            if stats is None:
+                stats = state.stats[metric] = RollingStats()
+
+            limits = state.thresholds.get(metric, {})
+            if "min" in limits and value < limits["min"]:
+                alerts.append(self.check(state, sensor_id, data, "threshold", metric, value, limit=limits["min"]))
+            elif "max" in limits and value > limits["max"]:
+                alerts.append(self.check(state, sensor_id, data, "threshold", metric, value, limit=limits["max"]))
+            else:
+                state.active.discard(("threshold", metric))
+
+            zscore = stats.zscore(value)
+            if zscore is not None and abs(zscore) > Z_THRESHOLD:
+                alerts.append(self.check(state, sensor_id, data, "anomaly", metric, value, mean=stats.mean, std=stats.var ** 0.5))
+            else:
+                state.active.discard(("anomaly", metric))
+            stats.update(value)
+
+        state.last = data
+        if last_seen is not None:
+            state.last_seen = last_seen
+        return [alert for alert in alerts if alert is not None]
+
+    def check(self, state, sensor_id, data, rule, metric, value, **details):
+        # Només avisem quan la mètrica entra en alerta, no a cada lectura mentre hi continua
+        if (rule, metric) in state.active:
+            return None
+        state.active.add((rule, metric))
+        alert = {"sensor_id": sensor_id, "rule": rule, "metric": metric, "value": value, **details,
+                 "last_seen": data.get("last_seen"), "detected_at": datetime.utcnow().isoformat()}
+        ALERTS.labels(rule, metric).inc()
+        self.publish(AlertMessage(alert))
+        return alert
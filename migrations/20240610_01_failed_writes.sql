@@ -0,0 +1,4 @@
+-- Escriptures secundàries pendents de reintentar
+-- depends: 20230212_01_VKKLZ
+
+CREATE TABLE IF NOT EXISTS failed_writes ( id serial PRIMARY KEY, operation varchar NOT NULL, payload text NOT NULL, error text, attempts integer NOT NULL DEFAULT 0, created_at timestamp DEFAULT now() );
@@ -0,0 +1,5 @@
+-- Outbox d'esdeveniments de sensors
+-- depends: 20240610_01_failed_writes
+
+CREATE TABLE IF NOT EXISTS outbox ( id serial PRIMARY KEY, event_type varchar NOT NULL, aggregate_id integer NOT NULL, payload text NOT NULL, created_at timestamp DEFAULT now(), published_at timestamp );
+CREATE INDEX IF NOT EXISTS ix_outbox_unpublished ON outbox (id) WHERE published_at IS NULL;
@@ -0,0 +1,4 @@
+-- Esdeveniments de l'outbox que una petició està projectant inline, el relay no els publica mentre no caduquin
+-- depends: 20240615_01_outbox
+
+ALTER TABLE outbox ADD COLUMN IF NOT EXISTS claimed_at timestamp;
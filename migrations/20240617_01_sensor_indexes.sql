@@ -0,0 +1,7 @@
+-- Índexs per filtrar per tipus o fabricant i paginar per id alhora
+-- depends: 20240616_01_outbox_claim
+
+ALTER TABLE sensors ADD COLUMN IF NOT EXISTS type varchar;
+ALTER TABLE sensors ADD COLUMN IF NOT EXISTS manufacturer varchar;
+CREATE INDEX IF NOT EXISTS ix_sensors_type_id ON sensors (type, id);
+CREATE INDEX IF NOT EXISTS ix_sensors_manufacturer_id ON sensors (manufacturer, id);
@@ -0,0 +1,28 @@
+"""
+Mida dels chunks i compressió de sensor_data, configurables amb TS_CHUNK_INTERVAL i TS_COMPRESS_AFTER
+(buit: sense política de compressió).
+"""
+import os
+
+from yoyo import step
+
+__depends__ = {"migrations_ts"}
+
+CHUNK_INTERVAL = os.environ.get("TS_CHUNK_INTERVAL", "1 day")
+COMPRESS_AFTER = os.environ.get("TS_COMPRESS_AFTER", "7 days")
+
+steps = [
+    step(
+        f"SELECT set_chunk_time_interval('sensor_data', INTERVAL '{CHUNK_INTERVAL}');",
+        "SELECT set_chunk_time_interval('sensor_data', INTERVAL '7 days');",
+    ),
+    # Comprimim per sensor i ordenat per temps, que és com llegim les dades
+    step(
+        "ALTER TABLE sensor_data SET (timescaledb.compress, timescaledb.compress_segmentby = 'id', timescaledb.compress_orderby = 'last_seen DESC');",
+        "ALTER TABLE sensor_data SET (timescaledb.compress = false);",
+    ),
+    step(
+        f"SELECT add_compression_policy('sensor_data', INTERVAL '{COMPRESS_AFTER}', if_not_exists => true);" if COMPRESS_AFTER else "SELECT 1;",
+        "SELECT remove_compression_policy('sensor_data', if_exists => true);",
+    ),
+]
@@ -0,0 +1,19 @@
+"""
+Retenció de sensor_data, només si TS_RETENTION (p.ex. "365 days") té valor; substitueix la d'abans.
+"""
+import os
+
+from yoyo import step
+
+__depends__ = {"20240601_01_sensor_data_policies"}
+
+RETENTION = os.environ.get("TS_RETENTION", "")
+
+steps = [
+    step("SELECT remove_retention_policy('sensor_data', if_exists => true);"),
+]
+if RETENTION:
+    steps.append(step(
+        f"SELECT add_retention_policy('sensor_data', INTERVAL '{RETENTION}', if_not_exists => true);",
+        "SELECT remove_retention_policy('sensor_data', if_exists => true);",
+    ))
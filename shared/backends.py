@@ -0,0 +1,57 @@
+"""
+Crea els clients dels backends segons BACKENDS: "docker" (per defecte) es connecta als serveis del docker-compose
+i "memory" fa servir els substituts en memòria de shared/memory, per mesurar només el cost de l'aplicació.
+"""
+import os
+
+BACKENDS = os.environ.get("BACKENDS", "docker")
+MEMORY = BACKENDS == "memory"
+
+
+def redis_client(host="redis"):
+    if MEMORY:
+        from shared.memory.redis_client import MemoryRedisClient
+        return MemoryRedisClient(host=host)
+    from shared.redis_client import RedisClient
+    return RedisClient(host=host)
+
+
+def mongodb_client():
+    if MEMORY:
+        from shared.memory.mongodb_client import MemoryMongoDBClient
+        return MemoryMongoDBClient()
+    from shared.mongodb_client import MongoDBClient
+    return MongoDBClient(host="mongodb")
+
+
+def elasticsearch_client():
+    if MEMORY:
+        from shared.memory.elasticsearch_client import MemoryElasticsearchClient
+        return MemoryElasticsearchClient()
+    from shared.elasticsearch_client import ElasticsearchClient
+    return ElasticsearchClient(host="elasticsearch")
+
+
+def cassandra_client():
+    if MEMORY:
+        from shared.memory.cassandra_client import MemoryCassandraClient
+        return MemoryCassandraClient()
+    from shared.cassandra_client import CassandraClient
+    return CassandraClient(hosts=["cassandra"])
+
+
+def timescale():
+    if MEMORY:
+        from shared.memory.timescale import MemoryTimescale
+        return MemoryTimescale()
+    from shared.timescale import Timescale
+    return Timescale()
+
+
+def publisher(queue_name, connect=True):
+    if MEMORY:
+        from shared.memory.queue import MemoryPublisher
+        return MemoryPublisher(queue_name=queue_name)
+    from shared.publisher import Publisher
+    return Publisher(queue_name=queue_name, connect=connect)
+
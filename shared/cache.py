@@ -0,0 +1,126 @@
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from redis.exceptions import RedisError
+
+from shared import backends
+from shared.redis_client import RedisClient
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 5))
+# Les rutes que agreguen lectures no s'invaliden a cada lectura (seria a cada petició d'ingesta), caduquen soles
+DATA_CACHE_TTL = int(os.environ.get("DATA_CACHE_TTL", CACHE_TTL))
+# Temps màxim que es manté el lock de càlcul i que els altres esperen el resultat
+LOCK_TIMEOUT = float(os.environ.get("CACHE_LOCK_TIMEOUT", 10))
+POLL_INTERVAL = 0.025
+
+_redis = None
+
+def get_redis() -> RedisClient:
+    # Un sol client (i pool de connexions) per procés per a la cache
+    global _redis
+    if _redis is None:
+        _redis = backends.redis_client(host=os.environ.get("REDIS_HOST", "redis"))
+    return _redis
+
+
+def cache_key(name, kwargs):
+    # Només els paràmetres simples (query params) formen part de la clau, no les dependències
+    params = sorted((key, value) for key, value in kwargs.items() if isinstance(value, (str, int, float, bool, type(None))))
+    return f"cache:{name}:{json.dumps(params)}"
+
+
+def tag_key(tag):
+    return f"cache:tag:{tag}"
+
+
+def cached(tags, ttl=CACHE_TTL):
+    """
+    Guarda la resposta serialitzada de la ruta a Redis durant ttl segons.
+
+    Quan falta l'entrada només un procés la calcula (lock a Redis), els altres esperen el resultat.
+    Les entrades s'esborren amb invalidate() de qualsevol dels seus tags.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = cache_key(func.__name__, kwargs)
+            token = None
+            try:
+                redis = get_redis()
+                body = redis.get(key)
+                if body is None:
+                    body, token = single_flight(redis, key)
+            except RedisError:
+                # Si Redis no respon servim sense cache
+                logger.exception("Response cache unavailable for %s", key)
+                redis = body = None
+            if body is None:
+                try:
+                    body = json.dumps(jsonable_encoder(func(*args, **kwargs))).encode()
+                    if redis is not None:
+                        store(redis, key, body)
+                finally:
+                    if token is not None:
+                        release(redis, key, token)
+            return Response(content=body, media_type="application/json")
+
+        def store(redis, key, body):
+            # Guardem la resposta i l'apuntem als seus tags en una sola anada a Redis
+            try:
+                pipe = redis.pipeline()
+                pipe.set(key, body, ex=ttl)
+                for tag in tags:
+                    pipe.sadd(tag_key(tag), key)
+                    pipe.expire(tag_key(tag), ttl * 2)
+                pipe.execute()
+            except RedisError:
+                logger.exception("Could not store %s in the response cache", key)
+
+        def release(redis, key, token):
+            # Només esborrem el lock si encara és nostre, no el d'un altre procés que l'ha agafat després que caduqués
+            try:
+                redis.delete_if_equals(key + ":lock", token)
+            except RedisError:
+                pass
+
+        return wrapper
+    return decorator
+
+
+def single_flight(redis, key):
+    """
+    Retorna (body, token): el resultat que ha deixat a la cache qui té el lock de càlcul de key, o (None, token)
+    si l'hem agafat nosaltres. Si passa LOCK_TIMEOUT sense resultat retorna (None, None) i es calcula sense lock.
+    """
+    lock = key + ":lock"
+    token = uuid.uuid4().hex.encode()
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not redis.set(lock, token, px=int(LOCK_TIMEOUT * 1000), nx=True):
+        time.sleep(POLL_INTERVAL)
+        body = redis.get(key)
+        if body is not None:
+            return body, None
+        if time.monotonic() > deadline:
+            return None, None
+    return None, token
+
+
+def invalidate(*tags):
+    """Esborra totes les entrades de la cache associades a algun dels tags."""
+    try:
+        redis = get_redis()
+        keys = set()
+        for tag in tags:
+            keys.update(redis.smembers(tag_key(tag)))
+        redis.delete(*keys, *(tag_key(tag) for tag in tags))
+    except RedisError:
+        logger.exception("Could not invalidate cache tags %s", tags)
@@ -1,5 +1,14 @@
+import os
+
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+
+from shared.metrics import instrument
+
+# Temps de vida (en segons) de les lectures guardades a Cassandra, 0 vol dir que no caduquen
+DATA_TTL = int(os.environ.get("CASSANDRA_DATA_TTL", 30 * 24 * 3600))
 
+@instrument("cassandra", exclude=("get_session",))
 class CassandraClient:
     def __init__(self, hosts):
         self.cluster = Cluster(hosts,protocol_version=4)
@@ -11,22 +20,29 @@ class CassandraClient:
         self.session.execute(keyspace_query)
 
         #Creamos la tabla de temperature
-        temperature_table_query = "CREATE TABLE IF NOT EXISTS sensor.temperature(id int, temperature float, PRIMARY KEY(id, temperature));"
+        temperature_table_query = f"CREATE TABLE IF NOT EXISTS sensor.temperature(id int, temperature float, PRIMARY KEY(id, temperature)) WITH default_time_to_live = {DATA_TTL};"
         self.session.execute(temperature_table_query)  
 
-        #Creamos la tabla de quantity
-        quantity_table_query = "CREATE TABLE IF NOT EXISTS sensor.quantity(id int, type text, PRIMARY KEY(type, id));"
-        self.session.execute(quantity_table_query)
-
         #Creamos la tabla de battery level
-        battery_table_query = "CREATE TABLE IF NOT EXISTS sensor.battery(id int, battery_level float, PRIMARY KEY(battery_level, id));"
+        battery_table_query = f"CREATE TABLE IF NOT EXISTS sensor.battery(id int, battery_level float, PRIMARY KEY(battery_level, id)) WITH default_time_to_live = {DATA_TTL};"
         self.session.execute(battery_table_query)
 
+        #Si les taules ja existien amb un altre TTL, l'actualitzem
+        ttl_query = "SELECT table_name, default_time_to_live FROM system_schema.tables WHERE keyspace_name = 'sensor' AND table_name IN ('temperature', 'battery');"
+        for row in self.session.execute(ttl_query):
+            if row.default_time_to_live != DATA_TTL:
+                self.session.execute(f"ALTER TABLE sensor.{row.table_name} WITH default_time_to_live = {DATA_TTL};")
+
     def get_session(self):
         return self.session
 
     def close(self):
         self.cluster.shutdown()
 
-    def execute(self, query):
-        return self.get_session().execute(query)
\ No newline at end of file
+    def execute(self, query, params=None):
+        return self.get_session().execute(query, params)
+
+    def execute_concurrent(self, query, params_list, concurrency=100):
+        # Prepara la sentència un cop i l'executa amb tots els paràmetres amb diverses peticions en vol
+        statement = self.get_session().prepare(query)
+        return execute_concurrent_with_args(self.get_session(), statement, params_list, concurrency=concurrency, raise_on_first_error=True)
\ No newline at end of file
@@ -1,6 +1,9 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 import time
 
+from shared.metrics import instrument
+
+@instrument("elasticsearch")
 class ElasticsearchClient:
     def __init__(self, host="localhost", port="9200"):
         self.host = host
@@ -47,8 +50,17 @@ class ElasticsearchClient:
     def search(self, index_name, query):
         return self.client.search(index=index_name, body=query)
     
-    def index_document(self, index_name, document):
-        return self.client.index(index=index_name, document=document)
+    def index_document(self, index_name, document, id=None):
+        return self.client.index(index=index_name, id=id, document=document)
+
+    def bulk_index(self, index_name, documents):
+        # documents és una llista de (id, document), s'envien en una sola petició _bulk
+        actions = [{"_index": index_name, "_id": id, "_source": document} for id, document in documents]
+        return helpers.bulk(self.client, actions)
+
+    def delete_document(self, index_name, id):
+        # Si el document ja no hi és no fem res, així l'esborrat és idempotent
+        return self.client.options(ignore_status=404).delete(index=index_name, id=id)
     
 
     
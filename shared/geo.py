@@ -0,0 +1,44 @@
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Precisió del geohash per a cada nivell de zoom del mapa: cada caràcter afegeix 5 bits (uns 2,5 nivells de zoom)
+ZOOM_PRECISION = (1, 1, 1, 2, 2, 2, 3, 3, 4, 4, 4, 5, 5, 6, 6, 6, 7, 7, 8, 8, 8, 9, 9)
+MAX_PRECISION = 12
+
+
+def geohash(latitude: float, longitude: float, precision: int = MAX_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Els bits parells parteixen la longitud i els senars la latitud
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits << 1 | 1
+            interval[0] = middle
+        else:
+            bits = bits << 1
+            interval[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[bits])
+            bits, bit = 0, 0
+    return "".join(chars)
+
+
+def precision_for_zoom(zoom: int) -> int:
+    return ZOOM_PRECISION[max(0, min(zoom, len(ZOOM_PRECISION) - 1))]
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    # (alt, ample) en graus d'una cel·la de geohash de la precisió donada
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cells_in_bbox(min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float, precision: int) -> int:
+    height, width = cell_size(precision)
+    # Si min_longitude > max_longitude la caixa travessa l'antimeridià
+    span = max_longitude - min_longitude if min_longitude <= max_longitude else 360.0 - (min_longitude - max_longitude)
+    return (int((max_latitude - min_latitude) / height) + 2) * (int(span / width) + 2)
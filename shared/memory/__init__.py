@@ -0,0 +1,40 @@
+"""
+Substituts en memòria dels backends de shared/, per fer proves de càrrega i profiling sense xarxa ni contenidors.
+
+Es fan servir amb BACKENDS=memory (vegeu shared/backends.py). Cada crida a un mètode públic pot esperar una latència
+fixa per simular l'anada a la xarxa: BACKEND_LATENCY_MS per a tots els backends o <BACKEND>_LATENCY_MS per a un de
+concret (p.ex. REDIS_LATENCY_MS=0.2), més una variació aleatòria de fins a BACKEND_LATENCY_JITTER_MS.
+"""
+import functools
+import os
+import random
+import time
+
+
+def latency(backend):
+    milliseconds = os.environ.get(f"{backend.upper()}_LATENCY_MS", os.environ.get("BACKEND_LATENCY_MS", 0))
+    return float(milliseconds) / 1000
+
+
+def with_latency(backend, exclude=()):
+    """Decorador de classe que fa esperar la latència configurada del backend abans de cada mètode públic."""
+    seconds = latency(backend)
+    jitter = float(os.environ.get("BACKEND_LATENCY_JITTER_MS", 0)) / 1000
+
+    def delayed(func):
+        @functools.wraps(func)
+        def simulated_latency(*args, **kwargs):
+            time.sleep(seconds + random.uniform(0, jitter))
+            return func(*args, **kwargs)
+        return simulated_latency
+
+    def decorator(cls):
+        if not seconds and not jitter:
+            return cls
+        for name in dir(cls):
+            attribute = getattr(cls, name)
+            if name.startswith("_") or name in exclude or not callable(attribute) or isinstance(attribute, type):
+                continue
+            setattr(cls, name, delayed(attribute))
+        return cls
+    return decorator
@@ -0,0 +1,61 @@
+import threading
+from collections import namedtuple
+
+from shared.memory import with_latency
+
+# Files de les taules del keyspace sensor, amb la clau primària de cada taula
+TEMPERATURE = set()  # (id, temperature)
+BATTERY = set()      # (battery_level, id)
+LOCK = threading.Lock()
+
+BatteryLevel = namedtuple("BatteryLevel", ["battery_level"])
+SensorBattery = namedtuple("SensorBattery", ["id", "battery_level"])
+TemperatureStats = namedtuple("TemperatureStats", ["id", "avg_temp", "min_temp", "max_temp"])
+
+
+def temperature_stats(params):
+    by_id = {}
+    for sensor_id, temperature in TEMPERATURE:
+        by_id.setdefault(sensor_id, []).append(temperature)
+    return [TemperatureStats(sensor_id, sum(values) / len(values), min(values), max(values)) for sensor_id, values in sorted(by_id.items())]
+
+
+# Les sentències CQL que fa servir el repositori, normalitzades (espais simples, sense ';' i amb %s com a marcador)
+STATEMENTS = {
+    "INSERT INTO sensor.temperature(id, temperature) VALUES (%s, %s)": lambda params: TEMPERATURE.add(tuple(params)),
+    "INSERT INTO sensor.battery(id, battery_level) VALUES (%s, %s)": lambda params: BATTERY.add((params[1], params[0])),
+    "DELETE FROM sensor.temperature WHERE id = %s": lambda params: TEMPERATURE.difference_update({row for row in TEMPERATURE if row[0] == params[0]}),
+    "DELETE FROM sensor.battery WHERE battery_level = %s AND id = %s": lambda params: BATTERY.discard(tuple(params)),
+    "SELECT battery_level FROM sensor.battery WHERE id = %s ALLOW FILTERING": lambda params: [BatteryLevel(level) for level, sensor_id in sorted(BATTERY) if sensor_id == params[0]],
+    "SELECT id, battery_level FROM sensor.battery WHERE battery_level < 0.2 ALLOW FILTERING": lambda params: sorted((SensorBattery(sensor_id, level) for level, sensor_id in BATTERY if level < 0.2), key=lambda row: row.id),
+    "SELECT id, AVG(temperature) AS avg_temp, MIN(temperature) AS min_temp, MAX(temperature) AS max_temp FROM sensor.temperature GROUP BY id": temperature_stats,
+}
+
+
+@with_latency("cassandra")
+class MemoryCassandraClient:
+    """Emula només les sentències de STATEMENTS; qualsevol altra llença NotImplementedError perquè no passi desapercebuda."""
+    def __init__(self, hosts=None):
+        self.hosts = hosts
+
+    def init_tables(self):
+        pass
+
+    def get_session(self):
+        return self
+
+    def close(self):
+        pass
+
+    def execute(self, query, params=None):
+        statement = " ".join(query.split()).rstrip(";").replace("?", "%s")
+        handler = STATEMENTS.get(statement)
+        if handler is None:
+            raise NotImplementedError(f"Statement not supported by the in-memory Cassandra: {statement}")
+        with LOCK:
+            result = handler(params)
+        return result if isinstance(result, list) else []
+
+    def execute_concurrent(self, query, params_list, concurrency=100):
+        # Mateix format que execute_concurrent_with_args: (success, result) per a cada paràmetre
+        return [(True, self.execute(query, params)) for params in params_list]
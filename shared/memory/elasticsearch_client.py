@@ -0,0 +1,114 @@
+import itertools
+import re
+import threading
+import uuid
+
+from shared.memory import with_latency
+
+# {index: {id: document}} i els camps de tipus keyword de cada índex (la resta es tracten com a text)
+INDICES = {}
+KEYWORDS = {"sensors": {"name", "type"}}
+LOCK = threading.Lock()
+
+
+def tokens(value):
+    return re.findall(r"\w+", str(value).lower())
+
+
+def distance(a, b):
+    # Distància de Levenshtein
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def fuzziness(term):
+    # Equivalent a fuzziness AUTO
+    return 0 if len(term) <= 2 else 1 if len(term) <= 5 else 2
+
+
+def score(query_type, value, field_value, keyword):
+    if field_value is None:
+        return 0
+    if keyword:
+        field_value = str(field_value)
+        if query_type in ("match", "term"):
+            return int(field_value == value)
+        if query_type == "prefix":
+            return int(field_value.startswith(value))
+        if query_type == "fuzzy":
+            return int(distance(field_value, value) <= fuzziness(value))
+    else:
+        terms = tokens(field_value)
+        if query_type == "match":
+            return len(set(tokens(value)) & set(terms))
+        if query_type == "term":
+            return int(value in terms)
+        if query_type == "prefix":
+            return int(any(term.startswith(value.lower()) for term in terms))
+        if query_type == "fuzzy":
+            return int(any(distance(term, value.lower()) <= fuzziness(value) for term in terms))
+    raise NotImplementedError(f"Query type not supported by the in-memory Elasticsearch: {query_type}")
+
+
+@with_latency("elasticsearch")
+class MemoryElasticsearchClient:
+    """Índexs en memòria amb les consultes match, term, prefix i fuzzy sobre un sol camp, les que fa servir l'API."""
+    def __init__(self, host=None, port=None):
+        self.host = host
+        self.port = port
+
+    def ping(self):
+        return True
+
+    def clearIndex(self, index_name):
+        with LOCK:
+            return INDICES.pop(index_name, None)
+
+    def close(self):
+        pass
+
+    def create_index(self, index_name):
+        with LOCK:
+            INDICES.setdefault(index_name, {})
+
+    def create_mapping(self, index_name, mapping):
+        KEYWORDS[index_name] = {field for field, options in mapping["properties"].items() if options.get("type") == "keyword"}
+
+    def search(self, index_name, query):
+        ((query_type, clause),) = query["query"].items()
+        ((field, value),) = clause.items()
+        if isinstance(value, dict):
+            value = value.get("query", value.get("value"))
+        keyword = field in KEYWORDS.get(index_name, set())
+        with LOCK:
+            documents = list(INDICES.get(index_name, {}).items())
+        scored = [(score(query_type, value, document.get(field), keyword), id, document) for id, document in documents]
+        hits = sorted((hit for hit in scored if hit[0] > 0), key=lambda hit: -hit[0])
+        return {"hits": {
+            "total": {"value": len(hits), "relation": "eq"},
+            "hits": [{"_index": index_name, "_id": id, "_score": float(hit_score), "_source": document}
+                     for hit_score, id, document in itertools.islice(hits, query.get("size", 10))],
+        }}
+
+    def index_document(self, index_name, document, id=None):
+        id = str(id) if id is not None else uuid.uuid4().hex
+        with LOCK:
+            INDICES.setdefault(index_name, {})[id] = dict(document)
+        return {"_index": index_name, "_id": id, "result": "created"}
+
+    def bulk_index(self, index_name, documents):
+        # Una sola "petició" per a tot el lot
+        with LOCK:
+            index = INDICES.setdefault(index_name, {})
+            for id, document in documents:
+                index[str(id)] = dict(document)
+        return len(documents), []
+
+    def delete_document(self, index_name, id):
+        with LOCK:
+            INDICES.get(index_name, {}).pop(str(id), None)
@@ -0,0 +1,61 @@
+import mongomock
+
+from shared.memory import with_latency
+from shared.mongodb_client import MongoDBClient
+
+CLIENT = mongomock.MongoClient()
+
+
+def rewrite_group(group: dict):
+    """
+    Adapta un $group als operadors que implementa mongomock. Retorna el $group nou, els camps que s'han de calcular
+    a cada document abans d'agrupar ({camp: funció(document)}) i els acumuladors $firstN a retallar ({camp: n}).
+    """
+    group = dict(group)
+    computed, limits = {}, {}
+    if isinstance(group['_id'], dict) and '$substrCP' in group['_id']:
+        field, start, length = group['_id']['$substrCP']
+        computed['_group'] = lambda document: (document.get(field[1:]) or '')[start:start + length]
+        group['_id'] = '$_group'
+    for name, accumulator in group.items():
+        if isinstance(accumulator, dict) and '$firstN' in accumulator:
+            group[name] = {'$push': accumulator['$firstN']['input']}
+            limits[name] = accumulator['$firstN']['n']
+    return group, computed, limits
+
+
+@with_latency("mongodb", exclude=("close",))
+class MemoryMongoDBClient(MongoDBClient):
+    def __init__(self, host=None, port=None):
+        self.host = host
+        self.port = port
+        self.client = CLIENT
+        self.database = self.client["MongoDB_"]
+        self.collection = self.database["sensors"]
+
+    def close(self):
+        # El client és compartit per tot el procés
+        pass
+
+    def ping(self):
+        return {'ok': 1.0}
+
+    def aggregateTiles(self, pipeline):
+        # mongomock no implementa $substrCP ni $firstN: executem les etapes anteriors al $group, hi afegim els camps
+        # calculats a Python i agrupem amb operadors que sí que implementa sobre una col·lecció temporal
+        index = next((i for i, stage in enumerate(pipeline) if '$group' in stage), None)
+        if index is None:
+            return super().aggregateTiles(pipeline)
+        group, computed, limits = rewrite_group(pipeline[index]['$group'])
+        documents = list(self._tiles().aggregate(pipeline[:index])) if index else list(self._tiles().find())
+        for document in documents:
+            for name, compute in computed.items():
+                document[name] = compute(document)
+        staging = mongomock.MongoClient()["staging"]["tiles"]
+        if documents:
+            staging.insert_many(documents)
+        results = list(staging.aggregate([{'$group': group}, *pipeline[index + 1:]]))
+        for result in results:
+            for name, n in limits.items():
+                result[name] = result[name][:n]
+        return results
@@ -0,0 +1,28 @@
+import os
+import threading
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+from shared.memory import with_latency
+from shared.publisher import QUEUE_NAME
+from shared.tracing import inject_headers
+
+# Missatges màxims per cua; com que ningú no els consumeix es descarten els més antics perquè la memòria no creixi sense límit
+MAX_MESSAGES = int(os.environ.get("MEMORY_QUEUE_MAX_MESSAGES", 10000))
+QUEUES = defaultdict(lambda: deque(maxlen=MAX_MESSAGES))
+LOCK = threading.Lock()
+
+
+@with_latency("rabbitmq")
+class MemoryPublisher:
+    def __init__(self, queue_name=QUEUE_NAME):
+        self.queue_name = queue_name
+
+    def publish(self, message):
+        properties = SimpleNamespace(headers=inject_headers())
+        with LOCK:
+            QUEUES[self.queue_name].append((properties, message.to_json()))
+
+    def close(self):
+        pass
+
@@ -0,0 +1,16 @@
+import fakeredis
+
+from shared.memory import with_latency
+from shared.redis_client import RedisClient
+
+# Totes les connexions del procés comparteixen les mateixes dades, com un servidor Redis
+SERVER = fakeredis.FakeServer()
+
+
+@with_latency("redis")
+class MemoryRedisClient(RedisClient):
+    def __init__(self, host=None, port=None, db=0):
+        self._host = host
+        self._port = port
+        self._db = db
+        self._client = fakeredis.FakeRedis(server=SERVER, db=db)
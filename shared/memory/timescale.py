@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+from shared.memory import with_latency
+from shared.timescale import bucket_interval
+
+# {(id, last_seen): (id, temperature, humidity, velocity, battery_level, last_seen)}, com la hypertable sensor_data
+ROWS = {}
+LOCK = threading.Lock()
+
+
+def parse_time(value) -> datetime:
+    # Com la columna timestamp, ignorem la zona horària
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=None)
+
+
+def bucket_start(time: datetime, bucket: str) -> datetime:
+    # Mateix inici de bucket que time_bucket (les setmanes comencen en dilluns)
+    day = time.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'hour':
+        return time.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def average(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+@with_latency("timescale")
+class MemoryTimescale:
+    """Emula les operacions de Timescale que fa servir l'API; les consultes SQL arbitràries no estan suportades."""
+    def __init__(self):
+        pass
+
+    def getCursor(self):
+        raise NotImplementedError("Raw SQL is not supported by the in-memory Timescale")
+
+    def close(self):
+        pass
+
+    def ping(self):
+        return True
+
+    def execute(self, query, params=None):
+        raise NotImplementedError("Raw SQL is not supported by the in-memory Timescale")
+
+    def commit(self):
+        pass
+
+    def insert_sensor_data(self, sensor_id: int, temperature: float | None, humidity: float | None, velocity: float | None, battery_level: float, last_seen: str):
+        last_seen = parse_time(last_seen)
+        with LOCK:
+            ROWS[(sensor_id, last_seen)] = (sensor_id, temperature, humidity, velocity, battery_level, last_seen)
+
+    def copy_sensor_data(self, rows) -> int:
+        rows = [(row[0], row[1], row[2], row[3], row[4], parse_time(row[5])) for row in rows]
+        with LOCK:
+            for row in rows:
+                ROWS[(row[0], row[5])] = row
+        return len({(row[0], row[5]) for row in rows})
+
+    def _bucketed(self, sensor_ids, from_date, end_date, bucket):
+        bucket_interval(bucket)
+        start, end = parse_time(from_date), parse_time(end_date)
+        with LOCK:
+            rows = [row for (sensor_id, last_seen), row in ROWS.items() if sensor_id in sensor_ids and start <= last_seen <= end]
+        groups = {}
+        for row in rows:
+            groups.setdefault((row[0], bucket_start(row[5], bucket)), []).append(row)
+        # (id, time, velocity, temperature, humidity, battery_level) ordenat per id i time
+        return [(sensor_id, time, average(row[3] for row in group), average(row[1] for row in group), average(row[2] for row in group), average(row[4] for row in group))
+                for (sensor_id, time), group in sorted(groups.items())]
+
+    def get_bucketed_data(self, sensor_id: int, from_date: str, end_date: str, bucket: str) -> list:
+        return [row[:5] for row in self._bucketed({sensor_id}, from_date, end_date, bucket)]
+
+    def get_bucketed_data_many(self, sensor_ids: list[int], from_date: str, end_date: str, bucket: str) -> list:
+        return self._bucketed(set(sensor_ids), from_date, end_date, bucket)
+
+    def delete(self, table):
+        with LOCK:
+            ROWS.clear()
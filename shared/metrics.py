@@ -0,0 +1,57 @@
+import functools
+import time
+
+from prometheus_client import Counter, Histogram
+
+from shared.tracing import tracer
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+BACKEND_LATENCY = Histogram(
+    "backend_operation_seconds", "Latency of backend client operations",
+    ["backend", "operation"], buckets=BUCKETS)
+BACKEND_ERRORS = Counter(
+    "backend_operation_errors_total", "Backend client operations that raised an exception",
+    ["backend", "operation", "exception"])
+
+DROPPED_WRITES = Counter(
+    "dropped_writes_total", "Best-effort secondary writes that failed and were not kept for retry",
+    ["operation"])
+
+HTTP_LATENCY = Histogram(
+    "http_request_seconds", "Latency of HTTP requests by route",
+    ["method", "route", "status"], buckets=BUCKETS)
+
+
+def timed(backend, operation, func):
+    # Resolem els labels un sol cop, així cada crida només paga el perf_counter i l'observe
+    histogram = BACKEND_LATENCY.labels(backend, operation)
+    span_name = f"{backend}.{operation}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Cada crida també és un span fill del span actiu, així la traça mostra quin backend triga més
+        with tracer.start_as_current_span(span_name, attributes={"db.system": backend}):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                BACKEND_ERRORS.labels(backend, operation, type(e).__name__).inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(backend, exclude=()):
+    """Decorador de classe que mesura i traça tots els mètodes públics d'un client, i el constructor com a 'connect'."""
+    def decorator(cls):
+        for name, attribute in list(vars(cls).items()):
+            if name in exclude or not callable(attribute):
+                continue
+            if name == "__init__":
+                setattr(cls, name, timed(backend, "connect", attribute))
+            elif not name.startswith("_"):
+                setattr(cls, name, timed(backend, name, attribute))
+        return cls
+    return decorator
@@ -1,5 +1,12 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient, ReplaceOne
 
+from shared.metrics import instrument
+
+# Col·lecció amb només la posició i el geohash de cada sensor, per agrupar-los al mapa
+TILES_COLLECTION = "sensor_tiles"
+_tiles_indexed = False
+
+@instrument("mongodb")
 class MongoDBClient:
     def __init__(self, host="localhost", port=27017):
         self.host = host
@@ -28,8 +35,37 @@ class MongoDBClient:
     def insertDoc(self, doc):
         return self.collection.insert_one(doc)
 
+    def upsertDoc(self, query, doc):
+        return self.collection.replace_one(query, doc, upsert=True)
+
+    def upsertMany(self, docs):
+        # Reemplaça per id en una sola petició, es pot repetir sense duplicar documents
+        return self.collection.bulk_write([ReplaceOne({'id': doc['id']}, doc, upsert=True) for doc in docs], ordered=False)
+
     def deleteOne(self, sensor_id):
         return self.collection.delete_one({'id': sensor_id})
     
     def getDocument(self,query):
         return self.collection.find_one(query, {'_id': 0})
+
+    def _tiles(self):
+        # Els índexs es creen un sol cop per procés
+        global _tiles_indexed
+        collection = self.database[TILES_COLLECTION]
+        if not _tiles_indexed:
+            collection.create_index([("id", ASCENDING)], unique=True)
+            collection.create_index([("latitude", ASCENDING), ("longitude", ASCENDING)])
+            _tiles_indexed = True
+        return collection
+
+    def upsertTiles(self, tiles):
+        return self._tiles().bulk_write([ReplaceOne({'id': tile['id']}, tile, upsert=True) for tile in tiles], ordered=False)
+
+    def deleteTile(self, sensor_id):
+        return self._tiles().delete_one({'id': sensor_id})
+
+    def aggregateTiles(self, pipeline):
+        return list(self._tiles().aggregate(pipeline))
+
+    def clearTiles(self):
+        return self._tiles().delete_many({})
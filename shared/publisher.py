@@ -1,33 +1,82 @@
+import logging
+import os
 import pika
+import threading
 import time
 
+from shared.metrics import instrument
+from shared.tracing import inject_headers
+
+logger = logging.getLogger(__name__)
+
 QUEUE_NAME = 'test'
+OUTBOX_QUEUE_NAME = 'sensor_events'
+# Esdeveniments que els projectors no han pogut aplicar després de tots els reintents, per revisar-los a mà
+OUTBOX_DEAD_LETTER_QUEUE_NAME = 'sensor_events_dead'
+# Cada lectura rebuda per l'API, per avaluar-ne les regles al consumidor
+READINGS_QUEUE_NAME = 'sensor_readings'
+# Alertes generades pel consumidor
+ALERTS_QUEUE_NAME = 'sensor_alerts'
+
+CONNECT_TIMEOUT = float(os.environ.get("RABBITMQ_CONNECT_TIMEOUT", 2))
+RECONNECT_INTERVAL = float(os.environ.get("RABBITMQ_RECONNECT_INTERVAL", 5))
 
+@instrument("rabbitmq")
 class Publisher:
 
     channel = None
     conn = None
 
-    def __init__(self):
+    def __init__(self, queue_name=QUEUE_NAME, connect=True):
+        self.queue_name = queue_name
+        # La connexió de pika no és thread-safe i a l'API el mateix publisher el fan servir diversos fils
+        self.lock = threading.Lock()
+        self.retry_at = 0
         credentials = pika.PlainCredentials('guest', 'guest')
-        parameters = pika.ConnectionParameters('rabbitmq',
+        self.parameters = pika.ConnectionParameters(os.environ.get("RABBITMQ_HOST", "rabbitmq"),
                                        5672,
                                        '/',
-                                       credentials)
-        try:
-            self.conn = pika.BlockingConnection(parameters)
-        except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+                                       credentials,
+                                       socket_timeout=CONNECT_TIMEOUT)
+        # Amb connect=False es connecta a la primera publicació, així crear-lo no falla ni espera si RabbitMQ no hi és
+        if connect:
+            try:
+                self._connect()
+            except Exception as e:
+                time.sleep(10)
+                self._connect()
 
+    def _connect(self):
+        self.conn = pika.BlockingConnection(self.parameters)
         self.channel = self.conn.channel()
-        self.channel.queue_declare(queue=QUEUE_NAME)
+        self.channel.queue_declare(queue=self.queue_name)
 
+    def _reconnect(self):
+        # Si RabbitMQ no respon no ho tornem a provar fins passat RECONNECT_INTERVAL, perquè cada publicació falli
+        # de seguida (i quedi a failed_writes) en lloc d'esperar el timeout de connexió
+        if time.monotonic() < self.retry_at:
+            raise pika.exceptions.AMQPConnectionError("RabbitMQ unavailable, not retrying yet")
+        self.channel = None
+        try:
+            self._connect()
+        except Exception:
+            self.retry_at = time.monotonic() + RECONNECT_INTERVAL
+            raise
 
-    
     def publish(self, message):
-        self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.to_json())
-        print(" [x] Sent %r" % message)
-    
+        # Enviem el context de la traça a les capçaleres perquè el consumidor la continuï
+        properties = pika.BasicProperties(headers=inject_headers())
+        with self.lock:
+            if self.channel is None:
+                self._reconnect()
+            try:
+                self.channel.basic_publish(exchange='', routing_key=self.queue_name, body=message.to_json(), properties=properties)
+            except pika.exceptions.AMQPError:
+                # Si la connexió s'ha tancat (p.ex. per heartbeat mentre estava inactiva) la tornem a obrir un cop
+                self._reconnect()
+                self.channel.basic_publish(exchange='', routing_key=self.queue_name, body=message.to_json(), properties=properties)
+        logger.debug(" [x] Sent %r", message)
+
     def close(self):
-        self.conn.close()
+        if self.conn is not None:
+            self.conn.close()
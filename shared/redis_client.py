@@ -1,5 +1,32 @@
 import redis
 
+from shared.metrics import instrument, timed
+
+
+class Pipeline:
+    """Pipeline de redis-py amb l'execute mesurat i traçat com la resta d'operacions del client."""
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def __getattr__(self, name):
+        attribute = getattr(self._pipe, name)
+        if not callable(attribute):
+            return attribute
+
+        def queue(*args, **kwargs):
+            # Les ordres encuades retornen el pipeline per encadenar-les; retornem aquest perquè l'execute quedi mesurat
+            result = attribute(*args, **kwargs)
+            return self if result is self._pipe else result
+        return queue
+
+    def execute(self):
+        return self._pipe.execute()
+
+    execute = timed("redis", "pipeline_execute", execute)
+
+
+# Crear el pipeline no va a la xarxa, el que es mesura és el seu execute
+@instrument("redis", exclude=("pipeline",))
 class RedisClient:
     def __init__(self, host='localhost', port=6379, db=0):
         self._host = host
@@ -16,11 +43,48 @@ class RedisClient:
     def get(self, key):
         return self._client.get(key)
     
-    def set(self, key, value):
-        return self._client.set(key, value)
+    def set(self, key, value, ex=None, px=None, nx=False):
+        return self._client.set(key, value, ex=ex, px=px, nx=nx)
     
-    def delete(self, key):
-        return self._client.delete(key)
+    def delete(self, *keys):
+        return self._client.delete(*keys)
+
+    def delete_if_equals(self, key, value):
+        # Compare-and-delete atòmic amb WATCH: només esborra key si encara val value
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != value:
+                    pipe.unwatch()
+                    return 0
+                pipe.multi()
+                pipe.delete(key)
+                return pipe.execute()[0]
+            except redis.WatchError:
+                return 0
+
+    def set_if(self, key, value, replace):
+        # Set condicional atòmic amb WATCH: només escriu value si replace(valor actual) és cert.
+        # Si algú canvia key entre el GET i l'EXEC, tornem a comparar amb el valor nou
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if not replace(pipe.get(key)):
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.set(key, value)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    def smembers(self, key):
+        return self._client.smembers(key)
+
+    def pipeline(self):
+        return Pipeline(self._client.pipeline())
     
     def keys(self, pattern):
         return self._client.keys(pattern)
@@ -0,0 +1,65 @@
+import orjson
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+
+from shared.sensors import schemas
+
+FLOAT_FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+
+
+class Reading:
+    """Lectura d'un sensor amb els mateixos camps que schemas.SensorData, sense el cost d'un model pydantic."""
+    __slots__ = ("velocity", "temperature", "humidity", "battery_level", "last_seen")
+
+    def __init__(self, velocity, temperature, humidity, battery_level, last_seen):
+        self.velocity = velocity
+        self.temperature = temperature
+        self.humidity = humidity
+        self.battery_level = battery_level
+        self.last_seen = last_seen
+
+    @classmethod
+    def from_dict(cls, obj: dict) -> "Reading":
+        # Camí ràpid per al cas habitual (números i un string); qualsevol altra cosa la valida pydantic
+        if type(obj) is dict:
+            values = [obj.get(name) for name in FLOAT_FIELDS]
+            last_seen = obj.get("last_seen")
+            if type(last_seen) is str and values[3] is not None and all(value is None or type(value) in (float, int) for value in values):
+                return cls(*(None if value is None else float(value) for value in values), last_seen)
+        data = schemas.SensorData.parse_obj(obj)
+        return cls(data.velocity, data.temperature, data.humidity, data.battery_level, data.last_seen)
+
+    @classmethod
+    def from_json(cls, body: bytes) -> "Reading":
+        return cls.from_dict(orjson.loads(body))
+
+    def as_dict(self) -> dict:
+        return {
+            "velocity": self.velocity,
+            "temperature": self.temperature,
+            "humidity": self.humidity,
+            "battery_level": self.battery_level,
+            "last_seen": self.last_seen,
+        }
+
+    def to_json(self) -> bytes:
+        return orjson.dumps(self.as_dict())
+
+
+async def reading_body(request: Request) -> Reading:
+    """Dependència que llegeix el cos de la petició com a Reading, amb els mateixos errors 422 que FastAPI."""
+    try:
+        return Reading.from_json(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=[{"loc": ["body", e.pos], "msg": "JSON decode error", "type": "value_error.jsondecode"}])
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=[{**error, "loc": ["body", *error["loc"]]} for error in e.errors()])
+
+
+# Esquema del cos per a l'OpenAPI, ja que la ruta no el declara com a model
+READING_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": schemas.SensorData.schema()}},
+    },
+}
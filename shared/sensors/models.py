@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, DateTime, Float, Integer, String
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, Text, text
 from ..database import Base
 
 class Sensor(Base):
@@ -15,4 +15,37 @@ class Sensor(Base):
     firmware_version = Column(String)
     latitude = Column(Float)
     longitude = Column(Float)
-    description = Column(String)
\ No newline at end of file
+    description = Column(String)
+
+    #Índexs per filtrar per tipus o fabricant i paginar per id alhora
+    __table_args__ = (
+        Index("ix_sensors_type_id", "type", "id"),
+        Index("ix_sensors_manufacturer_id", "manufacturer", "id"),
+    )
+
+
+#Escriptures secundàries que han fallat i s'han de reintentar
+class FailedWrite(Base):
+    __tablename__ = "failed_writes"
+    id = Column(Integer, primary_key=True, index=True)
+    operation = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+#Esdeveniments escrits a la mateixa transacció que el sensor, el relay els publica a la cua
+class OutboxEvent(Base):
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)
+    aggregate_id = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    published_at = Column(DateTime, nullable=True)
+    #Quan una petició el projecta inline, el relay no el publica fins que no caduca la reserva
+    claimed_at = Column(DateTime, nullable=True)
+
+    #El relay només llegeix els pendents de publicar
+    __table_args__ = (Index("ix_outbox_unpublished", "id", postgresql_where=text("published_at IS NULL")),)
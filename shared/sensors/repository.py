@@ -1,16 +1,34 @@
 from fastapi import HTTPException
+from sqlalchemy import insert, or_
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from bson.son import SON
+import base64
+import binascii
 import json
+import logging
+import os
+
+import orjson
 
 from shared.mongodb_client import MongoDBClient
 from shared.redis_client import RedisClient
 from shared.sensors import models, schemas
+from shared.sensors.codec import Reading
 from shared.timescale import Timescale
 from shared.cassandra_client import CassandraClient
 from shared.elasticsearch_client import ElasticsearchClient
+from shared.tracing import traced
+from shared.write_coordinator import OPERATIONS, fan_out, write_operation
+from shared.publisher import Publisher
+from shared.cache import invalidate
+from shared import geo
+
+logger = logging.getLogger(__name__)
+
+# inline: el mateix request projecta l'esdeveniment als altres stores; async: ho fan el relay i els projectors
+SENSOR_PROJECTION = os.environ.get("SENSOR_PROJECTION", "inline")
 
 
 class DataCommand():
@@ -31,34 +49,318 @@ def get_sensor(db: Session, sensor_id: int) -> Optional[models.Sensor]:
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.name == name).first()
 
-def get_sensors(db: Session, skip: int = 0, limit: int = 100) -> List[models.Sensor]:
-    return db.query(models.Sensor).offset(skip).limit(limit).all()
+SENSOR_FIELDS = tuple(column.name for column in models.Sensor.__table__.columns)
+
+def encode_cursor(sensor_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'id': sensor_id}).encode()).decode()
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def get_sensors(db: Session, limit: int = 100, cursor: Optional[str] = None, fields: Optional[List[str]] = None, sensor_type: Optional[str] = None, manufacturer: Optional[str] = None) -> dict:
+    #Només seleccionem les columnes demanades, el id sempre perquè és la clau de paginació
+    fields = fields or list(SENSOR_FIELDS)
+    invalid = [field for field in fields if field not in SENSOR_FIELDS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(invalid)}")
+    if 'id' not in fields:
+        fields = ['id'] + fields
+    query = db.query(*(getattr(models.Sensor, field) for field in fields))
+
+    if sensor_type is not None:
+        query = query.filter(models.Sensor.type == sensor_type)
+    if manufacturer is not None:
+        query = query.filter(models.Sensor.manufacturer == manufacturer)
 
+    #Paginació per clau: continuem a partir de l'últim id de la pàgina anterior en lloc de fer offset
+    if cursor is not None:
+        query = query.filter(models.Sensor.id > decode_cursor(cursor))
+    rows = query.order_by(models.Sensor.id).limit(limit + 1).all()
 
-def create_sensor(db: Session, sensor: schemas.SensorCreate, mongodb_client: MongoDBClient, elasticsearch_client: ElasticsearchClient, cassandra_client: CassandraClient) -> models.Sensor:
+    sensors = [row._asdict() for row in rows[:limit]]
+    next_cursor = encode_cursor(sensors[-1]['id']) if len(rows) > limit else None
+    return {'sensors': sensors, 'next_cursor': next_cursor}
+
+
+@traced
+def create_sensor(db: Session, sensor: schemas.SensorCreate, mongodb_client: MongoDBClient, elasticsearch_client: ElasticsearchClient, redis: RedisClient) -> models.Sensor:
     db_sensor = models.Sensor(name=sensor.name, latitude=sensor.latitude, longitude=sensor.longitude, type=sensor.type, mac_address=sensor.mac_address, manufacturer=sensor.manufacturer, model=sensor.model, serie_number=sensor.serie_number, firmware_version=sensor.firmware_version, description=sensor.description)
     db.add(db_sensor)
-    db.commit()
-    db.refresh(db_sensor)
+    #Fem flush per tenir el id i guardem l'esdeveniment a l'outbox dins la mateixa transacció
+    db.flush()
 
-    mongodb_client.insertDoc(sensor.dict())
-    
-    #Afegim el name, type i description
-    data = {
-        'name': sensor.name,
-        'type': sensor.type,
-        'description': sensor.description
-    }
-    elasticsearch_client.index_document(index_name="sensors", document=data)
     sensor_dict = sensor.dict()
     sensor_dict.update({'id': db_sensor.id})
 
-    #Guardamos el id y el type en la tabla quantity
-    query_increment = f"INSERT INTO sensor.quantity(id, type) VALUES ({db_sensor.id}, '{sensor.type}');"
-    cassandra_client.execute(query_increment)
+    event = add_event(db, SENSOR_CREATED, db_sensor.id, sensor_dict, claim=SENSOR_PROJECTION == "inline")
+    db.commit()
+
+    #MongoDB, Elasticsearch i Redis s'actualitzen a partir de l'esdeveniment
+    if SENSOR_PROJECTION == "inline":
+        project_inline(db, event, {'mongodb': mongodb_client, 'elasticsearch': elasticsearch_client, 'redis': redis})
     return sensor_dict
 
 
+BULK_MAX_SENSORS = 5000
+
+@traced
+def create_sensors_bulk(db: Session, sensors: List[schemas.SensorCreate], mongodb_client: MongoDBClient, elasticsearch_client: ElasticsearchClient, redis: RedisClient) -> dict:
+    if len(sensors) > BULK_MAX_SENSORS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_SENSORS} sensors per request")
+
+    #Comprovem amb una sola query quins noms i MACs ja estan registrats
+    names = {sensor.name for sensor in sensors}
+    macs = {sensor.mac_address for sensor in sensors}
+    existing = db.query(models.Sensor.name, models.Sensor.mac_address).filter(or_(models.Sensor.name.in_(names), models.Sensor.mac_address.in_(macs))).all()
+    taken_names = {row.name for row in existing}
+    taken_macs = {row.mac_address for row in existing}
+
+    results = []
+    to_insert = []
+    for index, sensor in enumerate(sensors):
+        if sensor.name in taken_names:
+            results.append({'index': index, 'status': 'error', 'detail': "Sensor with same name already registered"})
+        elif sensor.mac_address in taken_macs:
+            results.append({'index': index, 'status': 'error', 'detail': "Sensor with same mac_address already registered"})
+        else:
+            #També marquem els de la pròpia petició per detectar duplicats dins el lot
+            taken_names.add(sensor.name)
+            taken_macs.add(sensor.mac_address)
+            results.append({'index': index, 'status': 'created'})
+            to_insert.append((index, sensor.dict()))
+
+    if not to_insert:
+        return {'sensors': results}
+
+    #Un sol INSERT ... RETURNING per a tots els sensors, i els esdeveniments a la mateixa transacció
+    rows = db.execute(insert(models.Sensor).returning(models.Sensor.id, models.Sensor.name), [sensor for _, sensor in to_insert]).all()
+    ids = {row.name: row.id for row in rows}
+    created = []
+    for index, sensor in to_insert:
+        sensor['id'] = ids[sensor['name']]
+        results[index]['id'] = sensor['id']
+        created.append(sensor)
+    events = [add_event(db, SENSOR_CREATED, sensor['id'], sensor, claim=SENSOR_PROJECTION == "inline") for sensor in created]
+    db.commit()
+
+    if SENSOR_PROJECTION == "inline":
+        project_bulk_inline(db, events, created, {'mongodb': mongodb_client, 'elasticsearch': elasticsearch_client, 'redis': redis})
+    return {'sensors': results}
+
+def project_bulk_inline(db: Session, events: List[models.OutboxEvent], sensors: List[dict], clients: dict):
+    #Les tres escriptures en lot van en paral·lel; si alguna falla els esdeveniments queden per al relay
+    try:
+        fan_out(db, [
+            ('mongodb.insert_sensors', clients['mongodb'], sensors),
+            ('elasticsearch.index_sensors', clients['elasticsearch'], sensors),
+            ('redis.increment_quantities', clients['redis'], sensors),
+        ], required=('mongodb.insert_sensors', 'elasticsearch.index_sensors', 'redis.increment_quantities'))
+    except Exception:
+        logger.exception("Inline bulk projection of %d sensors failed", len(sensors))
+        release_events(db, events)
+        return
+    invalidate("sensors")
+    now = datetime.utcnow()
+    for event in events:
+        event.published_at = now
+    db.commit()
+
+
+SENSOR_CREATED = 'sensor_created'
+SENSOR_DELETED = 'sensor_deleted'
+
+# Escriptures que cal fer a cada store per a cada tipus d'esdeveniment
+EVENT_WRITES = {
+    SENSOR_CREATED: ('mongodb.upsert_sensor', 'elasticsearch.index_sensor', 'redis.increment_quantity'),
+    SENSOR_DELETED: ('mongodb.delete_sensor', 'elasticsearch.delete_sensor', 'cassandra.delete_sensor', 'redis.delete_data', 'redis.decrement_quantity'),
+}
+
+# Temps que el relay respecta la reserva d'una projecció inline, per si el procés que la feia ha mort
+OUTBOX_CLAIM_TIMEOUT = timedelta(seconds=int(os.environ.get("OUTBOX_CLAIM_TIMEOUT", 60)))
+
+def add_event(db: Session, event_type: str, aggregate_id: int, payload: dict, claim: bool = False) -> models.OutboxEvent:
+    #Amb claim l'esdeveniment es reserva a la mateixa transacció perquè el relay no el publiqui mentre el projectem inline
+    event = models.OutboxEvent(event_type=event_type, aggregate_id=aggregate_id, payload=json.dumps(payload), claimed_at=datetime.utcnow() if claim else None)
+    db.add(event)
+    return event
+
+def release_events(db: Session, events: List[models.OutboxEvent]):
+    #La projecció inline ha fallat, alliberem la reserva perquè el relay els publiqui
+    for event in events:
+        event.claimed_at = None
+    db.commit()
+
+def project_event(db: Session, event_type: str, payload: dict, clients: dict):
+    #Totes les escriptures són idempotents, així es poden repetir si l'esdeveniment arriba més d'un cop
+    if event_type == SENSOR_CREATED and db.query(models.Sensor.id).filter(models.Sensor.id == payload['id']).first() is None:
+        #Un sensor_created endarrerit d'un sensor que ja s'ha esborrat no l'ha de tornar a crear
+        logger.info("Skipping sensor_created for deleted sensor %s", payload['id'])
+        return
+    names = EVENT_WRITES[event_type]
+    writes = [(name, clients[OPERATIONS[name][0]], payload) for name in names]
+    fan_out(db, writes, required=names)
+    invalidate("sensors")
+
+def project_inline(db: Session, event: models.OutboxEvent, clients: dict):
+    try:
+        project_event(db, event.event_type, json.loads(event.payload), clients)
+    except Exception:
+        #L'esdeveniment queda pendent i el relay el publicarà per als projectors
+        logger.exception("Inline projection of outbox event %s failed", event.id)
+        release_events(db, [event])
+        return
+    event.published_at = datetime.utcnow()
+    db.commit()
+
+class OutboxMessage():
+    def __init__(self, event: models.OutboxEvent):
+        self.id = event.id
+        self.type = event.event_type
+        self.payload = json.loads(event.payload)
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+class ReadingMessage():
+    def __init__(self, payload: dict):
+        self.payload = payload
+
+    def to_json(self):
+        return orjson.dumps(self.payload)
+
+def relay_outbox(db: Session, publisher: Publisher, limit: int = 100) -> int:
+    #SKIP LOCKED permet tenir més d'un relay sense que publiquin el mateix esdeveniment
+    events = (db.query(models.OutboxEvent)
+              .filter(models.OutboxEvent.published_at.is_(None))
+              .filter(or_(models.OutboxEvent.claimed_at.is_(None), models.OutboxEvent.claimed_at < datetime.utcnow() - OUTBOX_CLAIM_TIMEOUT))
+              .order_by(models.OutboxEvent.id)
+              .limit(limit)
+              .with_for_update(skip_locked=True)
+              .all())
+    for event in events:
+        publisher.publish(OutboxMessage(event))
+        event.published_at = datetime.utcnow()
+    db.commit()
+    return len(events)
+
+
+#Escriptures a cada backend, han de ser idempotents perquè es puguin reintentar
+def sensor_tile(sensor: dict) -> dict:
+    #Posició i geohash del sensor per agrupar-lo al mapa sense llegir el document sencer
+    return {'id': sensor['id'], 'type': sensor['type'], 'latitude': sensor['latitude'], 'longitude': sensor['longitude'],
+            'geohash': geo.geohash(sensor['latitude'], sensor['longitude'])}
+
+@write_operation('mongodb.upsert_sensor', 'mongodb')
+def write_mongodb_sensor(mongodb_client: MongoDBClient, sensor: dict):
+    mongodb_client.upsertDoc({'id': sensor['id']}, dict(sensor))
+    mongodb_client.upsertTiles([sensor_tile(sensor)])
+
+@write_operation('elasticsearch.index_sensor', 'elasticsearch')
+def write_elasticsearch_sensor(elasticsearch_client: ElasticsearchClient, sensor: dict):
+    #Afegim el name, type i description, amb el id del sensor com a id del document
+    data = {
+        'name': sensor['name'],
+        'type': sensor['type'],
+        'description': sensor['description']
+    }
+    elasticsearch_client.index_document(index_name="sensors", document=data, id=sensor['id'])
+
+@write_operation('mongodb.insert_sensors', 'mongodb')
+def write_mongodb_sensors(mongodb_client: MongoDBClient, sensors: List[dict]):
+    mongodb_client.upsertMany([dict(sensor) for sensor in sensors])
+    mongodb_client.upsertTiles([sensor_tile(sensor) for sensor in sensors])
+
+@write_operation('elasticsearch.index_sensors', 'elasticsearch')
+def write_elasticsearch_sensors(elasticsearch_client: ElasticsearchClient, sensors: List[dict]):
+    elasticsearch_client.bulk_index("sensors", [(sensor['id'], {'name': sensor['name'], 'type': sensor['type'], 'description': sensor['description']}) for sensor in sensors])
+
+#Sensors per tipus: un set d'ids per tipus (SCARD és el recompte) i el set dels tipus. SADD/SREM són idempotents,
+#així reprocessar un esdeveniment o reintentar l'escriptura no fa derivar els recomptes
+QUANTITY_TYPES_KEY = 'sensor:types'
+
+def quantity_key(sensor_type: str) -> str:
+    return f'sensor:type:{sensor_type}'
+
+@write_operation('redis.increment_quantity', 'redis')
+def increment_redis_quantity(redis: RedisClient, sensor: dict):
+    increment_redis_quantities(redis, [sensor])
+
+@write_operation('redis.decrement_quantity', 'redis')
+def decrement_redis_quantity(redis: RedisClient, sensor: dict):
+    pipe = redis.pipeline()
+    pipe.srem(quantity_key(sensor['type']), sensor['id'])
+    pipe.execute()
+
+@write_operation('redis.increment_quantities', 'redis')
+def increment_redis_quantities(redis: RedisClient, sensors: List[dict]):
+    pipe = redis.pipeline()
+    for sensor in sensors:
+        pipe.sadd(QUANTITY_TYPES_KEY, sensor['type'])
+        pipe.sadd(quantity_key(sensor['type']), sensor['id'])
+    pipe.execute()
+
+@write_operation('mongodb.delete_sensor', 'mongodb')
+def delete_mongodb_sensor(mongodb_client: MongoDBClient, sensor: dict):
+    mongodb_client.deleteOne(sensor['id'])
+    mongodb_client.deleteTile(sensor['id'])
+
+@write_operation('elasticsearch.delete_sensor', 'elasticsearch')
+def delete_elasticsearch_sensor(elasticsearch_client: ElasticsearchClient, sensor: dict):
+    elasticsearch_client.delete_document(index_name="sensors", id=sensor['id'])
+
+@write_operation('cassandra.delete_sensor', 'cassandra')
+def delete_cassandra_sensor(cassandra_client: CassandraClient, sensor: dict):
+    cassandra_client.execute("DELETE FROM sensor.temperature WHERE id = %s;", (sensor['id'],))
+    #A battery el id no és la partition key, primer busquem els nivells guardats
+    for row in cassandra_client.execute("SELECT battery_level FROM sensor.battery WHERE id = %s ALLOW FILTERING;", (sensor['id'],)):
+        cassandra_client.execute("DELETE FROM sensor.battery WHERE battery_level = %s AND id = %s;", (row.battery_level, sensor['id']))
+
+@write_operation('redis.delete_data', 'redis')
+def delete_redis_data(redis: RedisClient, sensor: dict):
+    redis.delete(sensor['id'])
+
+@write_operation('timescale.insert_data', 'timescale')
+def write_timescale_data(timescale: Timescale, payload: dict):
+    #Los None se envian como NULL con la sentencia preparada
+    data = payload['data']
+    timescale.insert_sensor_data(payload['id'], data['temperature'], data['humidity'], data['velocity'], data['battery_level'], data['last_seen'])
+
+@write_operation('cassandra.insert_temperature', 'cassandra')
+def write_cassandra_temperature(cassandra_client: CassandraClient, payload: dict):
+    cassandra_client.execute("INSERT INTO sensor.temperature(id, temperature) VALUES (%s, %s);", (payload['id'], payload['data']['temperature']))
+
+@write_operation('cassandra.insert_battery', 'cassandra')
+def write_cassandra_battery(cassandra_client: CassandraClient, payload: dict):
+    cassandra_client.execute("INSERT INTO sensor.battery(id, battery_level) VALUES (%s, %s);", (payload['id'], payload['data']['battery_level']))
+
+@write_operation('rabbitmq.publish_reading', 'rabbitmq')
+def publish_reading(publisher: Publisher, payload: dict):
+    publisher.publish(ReadingMessage(payload))
+
+def reading_time(value) -> Optional[datetime]:
+    # Instant d'una lectura guardada (bytes de Redis) o rebuda, en UTC sense zona; None si no en té
+    try:
+        data = orjson.loads(value) if isinstance(value, bytes) else value
+        seen = datetime.fromisoformat(data['last_seen'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if seen.tzinfo is not None:
+        seen = seen.astimezone(timezone.utc).replace(tzinfo=None)
+    return seen
+
+@write_operation('redis.set_data', 'redis')
+def write_redis_data(redis: RedisClient, payload: dict):
+    #Només guardem la lectura si no n'hi ha una de més nova, així reintentar-ne una d'antiga no trepitja l'última
+    last_seen = reading_time(payload['data'])
+    def replace(current):
+        current_seen = reading_time(current) if current is not None else None
+        return current_seen is None or last_seen is None or current_seen <= last_seen
+    redis.set_if(payload['id'], orjson.dumps(payload['data']), replace)
+
+
 def add_sensor_to_postgres(db: Session, sensor: schemas.SensorCreate) -> models.Sensor:
     date = datetime.now()
 
@@ -88,30 +390,30 @@ def add_sensor_to_mongodb(mongodb_client: MongoDBClient, db_sensor: schemas.Sens
 
 #Modificat: Creem la funcio record_data
 #Volem que els sensors puguin escriure les seves dades a la base
-def record_data(redis: RedisClient, sensor_id: int, data: schemas.SensorData, timescale: Timescale, cassandra_client: CassandraClient) -> schemas.SensorData:
+@traced
+def record_data(redis: RedisClient, sensor_id: int, data: Reading, timescale: Timescale, cassandra_client: CassandraClient, db: Session, publisher: Optional[Publisher] = None) -> dict:
     
     #Cogemos los datos de data y lo pasamos a un diccionario
-    data_sensor = data.dict()
-
-    #Tenemos que transformar los datos que sean None a Null para poderlas poner en SQL
-    new_data = {key: ('NULL' if value is None else value if key != 'last_seen' else f"'{value}'") for key, value in data_sensor.items()}
-
-    #Creamos la query para añadir los datos a TimescaleDB
-    query_sin_parametros = "INSERT INTO sensor_data (id, temperature, humidity, velocity, battery_level, last_seen) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (id, last_seen) DO UPDATE SET temperature = EXCLUDED.temperature, humidity = EXCLUDED.humidity, velocity = EXCLUDED.velocity, battery_level = EXCLUDED.battery_level;"
-    query = query_sin_parametros % (sensor_id, new_data['temperature'], new_data['humidity'], new_data['velocity'], new_data['battery_level'], new_data['last_seen'])
-    timescale.execute(query)
-    timescale.execute("commit")
-
-    #Guardamos la temperatura
+    data_sensor = data.as_dict()
+    payload = {'id': sensor_id, 'data': data_sensor}
+
+    #Escribimos en TimescaleDB, Cassandra y Redis en paralelo, la latencia es la del backend más lento
+    #TimescaleDB es obligatorio, si falla la petición falla; el resto se reintenta desde failed_writes
+    writes = [
+        ('timescale.insert_data', timescale, payload),
+        ('cassandra.insert_battery', cassandra_client, payload),
+        ('redis.set_data', redis, payload),
+    ]
     if data.temperature is not None:
-        query = f"INSERT INTO sensor.temperature(id, temperature) VALUES ({sensor_id}, {data.temperature});"
-        cassandra_client.execute(query)
+        writes.append(('cassandra.insert_temperature', cassandra_client, payload))
+    #La lectura també va a la cua perquè el consumidor n'avaluï les regles d'alerta. Si RabbitMQ no hi és no la guardem
+    #a failed_writes: en reintentar-la el motor de regles la descartaria igualment perquè ja n'ha vist de més noves
+    if publisher is not None:
+        writes.append(('rabbitmq.publish_reading', publisher, payload))
+    #No invalidem la cache: les rutes que agreguen lectures tenen un TTL curt (DATA_CACHE_TTL)
+    fan_out(db, writes, required=('timescale.insert_data',), best_effort=('rabbitmq.publish_reading',))
 
-    #Guardamos la battery
-    cassandra_client.execute(f"INSERT INTO sensor.battery(id, battery_level) VALUES ({sensor_id}, {data.battery_level});")
-
-    redis.set(sensor_id, json.dumps(data_sensor))
-    return json.loads(redis.get(sensor_id))
+    return data_sensor
 
 
 def getView(bucket: str) -> str:
@@ -129,56 +431,106 @@ def getView(bucket: str) -> str:
         raise ValueError("Invalid bucket size")
 
 
+@traced
 def get_data(redis: RedisClient, sensor_id: int, db: Session) -> schemas.Sensor:
     #Agafem la base de dades del sensor
     db_sensor = redis.get(sensor_id)
         
     #Si la tenim, retornem les dades més el id i el nom 
     if db_sensor:
-        db_dada = json.loads(db_sensor)
+        db_dada = orjson.loads(db_sensor)
         db_dada["id"] = sensor_id
         db_dada["name"] = get_sensor(db, sensor_id).name
         return db_dada
 
+@traced
 def get_data_timescale(sensor_id: int, timescale: Timescale, from_date: str, end_date: str, bucket: str) -> schemas.Sensor:
-    # Contruimos la query para que nos de los datos de los sensores agrupados por intervalos de tiempo
-
-    query = f"""
-        SELECT 
-            id,
-            time_bucket('1 {bucket}', last_seen) AS {bucket},
-            AVG(velocity) AS velocity,
-            AVG(temperature) AS temperature,
-            AVG(humidity) AS humidity
-        FROM sensor_data
-        WHERE id = {sensor_id} AND last_seen >= '{from_date}' AND last_seen <= '{end_date}'
-        GROUP BY id, time_bucket('1 {bucket}', last_seen)
-        ORDER BY {bucket} ASC;
-    """
-
-    # Ejecutamos la query
-    timescale.execute(query)
-
-    # Obtenemos los resultados
-    result = timescale.getCursor().fetchall()
-
-    return result
-
-def delete_sensor(db: Session, sensor_id: int, mongodb_client: MongoDBClient, redis: RedisClient):
+    # Obtenemos los datos del sensor agrupados por intervalos de tiempo, el bucket se valida contra la lista permitida
+    try:
+        return timescale.get_bucketed_data(sensor_id, from_date, end_date, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def get_sensor_ids(db: Session, sensor_type: Optional[str] = None, latitude: Optional[float] = None, longitude: Optional[float] = None, radius: Optional[float] = None) -> List[int]:
+    #Agafem nomes els ids dels sensors que compleixen els filtres de tipus i de posicio
+    query = db.query(models.Sensor.id)
+    if sensor_type is not None:
+        query = query.filter(models.Sensor.type == sensor_type)
+    if latitude is not None and longitude is not None and radius is not None:
+        query = query.filter(models.Sensor.latitude.between(latitude - radius, latitude + radius),
+                             models.Sensor.longitude.between(longitude - radius, longitude + radius))
+    return [row.id for row in query.order_by(models.Sensor.id).all()]
+
+@traced
+def query_data_timescale(sensor_ids: List[int], timescale: Timescale, from_date: str, end_date: str, bucket: str) -> dict:
+    # Una unica query agrupada per a tots els sensors en lloc d'una per sensor
+    try:
+        rows = timescale.get_bucketed_data_many(sensor_ids, from_date, end_date, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Retornem el resultat en columnes: una llista de valors per metrica i per sensor
+    sensors = {}
+    for sensor_id, time, velocity, temperature, humidity, battery_level in rows:
+        columns = sensors.get(sensor_id)
+        if columns is None:
+            columns = sensors[sensor_id] = {'id': sensor_id, 'time': [], 'velocity': [], 'temperature': [], 'humidity': [], 'battery_level': []}
+        columns['time'].append(time.isoformat())
+        columns['velocity'].append(velocity)
+        columns['temperature'].append(temperature)
+        columns['humidity'].append(humidity)
+        columns['battery_level'].append(battery_level)
+
+    return {'bucket': bucket, 'sensors': list(sensors.values())}
+
+def fetch_dicts(timescale: Timescale, query: str, params=None) -> List[dict]:
+    timescale.execute(query, params)
+    cursor = timescale.getCursor()
+    columns = [column.name for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+@traced
+def get_timescale_stats(timescale: Timescale) -> dict:
+    #Chunks de la hypertable amb la seva mida i si estan comprimits
+    chunks = fetch_dicts(timescale, """
+        SELECT c.chunk_name, c.range_start, c.range_end, c.is_compressed, s.total_bytes
+        FROM timescaledb_information.chunks c
+        JOIN chunks_detailed_size('sensor_data') s ON s.chunk_name = c.chunk_name
+        WHERE c.hypertable_name = 'sensor_data'
+        ORDER BY c.range_start;
+    """)
+
+    #Estadistiques de compressio de tota la hypertable
+    compression = fetch_dicts(timescale, """
+        SELECT total_chunks, number_compressed_chunks, before_compression_total_bytes, after_compression_total_bytes
+        FROM hypertable_compression_stats('sensor_data');
+    """)
+
+    #Politiques de compressio i retencio que hi ha programades
+    policies = fetch_dicts(timescale, """
+        SELECT proc_name, schedule_interval, config
+        FROM timescaledb_information.jobs
+        WHERE hypertable_name = 'sensor_data';
+    """)
+
+    return {'chunks': chunks, 'compression': compression[0] if compression else None, 'policies': policies}
+
+@traced
+def delete_sensor(db: Session, sensor_id: int, mongodb_client: MongoDBClient, redis: RedisClient, elasticsearch_client: ElasticsearchClient, cassandra_client: CassandraClient):
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
     db.delete(db_sensor)
+    event = add_event(db, SENSOR_DELETED, sensor_id, {'id': sensor_id, 'name': db_sensor.name, 'type': db_sensor.type}, claim=SENSOR_PROJECTION == "inline")
     db.commit()
 
-    #Eliminem de mongodb el fixer amb id sensor_id
-    mongodb_client.deleteOne(sensor_id)
-
-    #Eliminem el de redis també
-    redis.delete(sensor_id)
+    #Eliminem el sensor de mongodb, elasticsearch, cassandra i redis a partir de l'esdeveniment
+    if SENSOR_PROJECTION == "inline":
+        project_inline(db, event, {'mongodb': mongodb_client, 'elasticsearch': elasticsearch_client, 'cassandra': cassandra_client, 'redis': redis})
 
     return db_sensor
 
+@traced
 def get_sensors_near(redis: RedisClient, mongodb_client: MongoDBClient, db: Session, latitude: float, longitude: float, radius: float):
     #Llista de retorn amb els nears que hi ha
     nears = []
@@ -213,7 +565,84 @@ def get_sensors_near(redis: RedisClient, mongodb_client: MongoDBClient, db: Sess
 
     return nears
 
+MAX_CLUSTERS = 2000
+#El resum de les últimes lectures es fa amb una mostra de sensors per grup i com a molt CLUSTER_SUMMARY_READINGS
+#lectures per petició, així el cost depèn de les cel·les visibles i no del nombre de sensors de la caixa
+CLUSTER_SUMMARY_SAMPLE = int(os.environ.get("CLUSTER_SUMMARY_SAMPLE", 20))
+CLUSTER_SUMMARY_READINGS = int(os.environ.get("CLUSTER_SUMMARY_READINGS", 2000))
+
+@traced
+def get_sensor_clusters(mongodb_client: MongoDBClient, redis: RedisClient, min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float, zoom: int, summary: bool = True) -> dict:
+    #Agrupem els sensors de la caixa per prefix de geohash, així la resposta creix amb les cel·les visibles i no amb els sensors
+    precision = geo.precision_for_zoom(zoom)
+    if min_latitude > max_latitude:
+        raise HTTPException(status_code=400, detail="min_latitude must not be greater than max_latitude")
+    if geo.cells_in_bbox(min_latitude, min_longitude, max_latitude, max_longitude, precision) > MAX_CLUSTERS:
+        raise HTTPException(status_code=400, detail="Bounding box too large for this zoom level")
+
+    if min_longitude <= max_longitude:
+        longitude = {'longitude': {'$gte': min_longitude, '$lte': max_longitude}}
+    else:
+        #La caixa travessa l'antimeridià
+        longitude = {'$or': [{'longitude': {'$gte': min_longitude}}, {'longitude': {'$lte': max_longitude}}]}
+    group = {'_id': {'$substrCP': ['$geohash', 0, precision]}, 'count': {'$sum': 1}, 'latitude': {'$avg': '$latitude'}, 'longitude': {'$avg': '$longitude'}}
+    if summary:
+        group['ids'] = {'$firstN': {'input': '$id', 'n': CLUSTER_SUMMARY_SAMPLE}}
+    groups = mongodb_client.aggregateTiles([
+        {'$match': {'latitude': {'$gte': min_latitude, '$lte': max_latitude}, **longitude}},
+        {'$group': group},
+        {'$sort': {'_id': 1}},
+    ])
+
+    latest = {}
+    if summary:
+        #Les últimes lectures dels sensors de la mostra en una sola anada a Redis
+        per_cluster = max(1, CLUSTER_SUMMARY_READINGS // max(1, len(groups)))
+        for cluster in groups:
+            cluster['ids'] = cluster['ids'][:per_cluster]
+        ids = [sensor_id for cluster in groups for sensor_id in cluster['ids']]
+        pipe = redis.pipeline()
+        for sensor_id in ids:
+            pipe.get(sensor_id)
+        latest = {sensor_id: orjson.loads(value) for sensor_id, value in zip(ids, pipe.execute()) if value is not None}
+
+    clusters = []
+    for cluster in groups:
+        result = {'geohash': cluster['_id'], 'count': cluster['count'], 'latitude': cluster['latitude'], 'longitude': cluster['longitude']}
+        if summary:
+            result['latest'] = summarize_latest([latest[sensor_id] for sensor_id in cluster['ids'] if sensor_id in latest])
+            result['latest']['sampled'] = len(cluster['ids'])
+        clusters.append(result)
+    return {'zoom': zoom, 'precision': precision, 'clusters': clusters}
+
+def summarize_latest(readings: List[dict]) -> dict:
+    summary = {'sensors_with_data': len(readings)}
+    for metric in ('temperature', 'humidity', 'velocity'):
+        values = [reading[metric] for reading in readings if reading.get(metric) is not None]
+        summary[metric] = {'avg': sum(values) / len(values), 'min': min(values), 'max': max(values)} if values else None
+    batteries = [reading['battery_level'] for reading in readings if reading.get('battery_level') is not None]
+    summary['min_battery_level'] = min(batteries) if batteries else None
+    summary['last_seen'] = max((reading['last_seen'] for reading in readings if reading.get('last_seen')), default=None)
+    return summary
+
+@traced
+def rebuild_sensor_tiles(db: Session, mongodb_client: MongoDBClient, batch_size: int = 1000) -> dict:
+    #Torna a generar la col·lecció de cel·les a partir de PostgreSQL, per als sensors creats abans que existís
+    rebuilt = 0
+    last_id = 0
+    while True:
+        sensors = (db.query(models.Sensor.id, models.Sensor.type, models.Sensor.latitude, models.Sensor.longitude)
+                   .filter(models.Sensor.id > last_id).order_by(models.Sensor.id).limit(batch_size).all())
+        if not sensors:
+            break
+        mongodb_client.upsertTiles([sensor_tile(sensor._asdict()) for sensor in sensors])
+        rebuilt += len(sensors)
+        last_id = sensors[-1].id
+    invalidate("sensors")
+    return {'rebuilt': rebuilt}
+
 #Cerca de sensors
+@traced
 def search_sensors(db: Session, mongodb_client: MongoDBClient, query: str, size: int, search_type: str, elastic_client: ElasticsearchClient):
     search = list()
 
@@ -246,6 +675,7 @@ def get_sensor_mongo(mongodb_client: MongoDBClient, db_sensor: models.Sensor) ->
     return sensor
 
 #Hemos de retornar un dict, ya que es lo que esperan los test
+@traced
 def get_temperature_values(db: Session, mongodb_client: MongoDBClient, cassandra_client: CassandraClient):
     
     query = """
@@ -265,15 +695,51 @@ def get_temperature_values(db: Session, mongodb_client: MongoDBClient, cassandra
 
     return {'sensors': sensors}
 
-def get_sensors_quantity(cassandra_client: CassandraClient):
-    query = """
-        SELECT type, count(*) AS quantity FROM sensor.quantity GROUP BY type;
-        """
-    results = cassandra_client.execute(query)
+@traced
+def get_sensors_quantity(redis: RedisClient, db: Session):
+    #Llegim els sets mantinguts a cada alta i baixa, és O(tipus)
+    sensor_types = [(sensor_type.decode() if isinstance(sensor_type, bytes) else sensor_type) for sensor_type in redis.smembers(QUANTITY_TYPES_KEY)]
+    if sensor_types:
+        pipe = redis.pipeline()
+        for sensor_type in sensor_types:
+            pipe.scard(quantity_key(sensor_type))
+        quantities = dict(zip(sensor_types, pipe.execute()))
+    else:
+        #Si no hi són (Redis buidat) els reconstruïm des de PostgreSQL
+        quantities = reconcile_sensor_quantities(db, redis)
 
-    sensors = [{'type': row.type, 'quantity': row.quantity} for row in results]
+    sensors = [{'type': sensor_type, 'quantity': quantity} for sensor_type, quantity in sorted(quantities.items()) if quantity > 0]
     return {'sensors': sensors}
 
+def reconcile_sensor_quantities(db: Session, redis: RedisClient) -> dict:
+    #Llegim primer els sets de Redis i després PostgreSQL i només n'apliquem les diferències. Així una alta que arribi
+    #mentre reconciliem no s'esborra: el seu SADD és posterior a la lectura de Redis i no surt entre les baixes
+    old_types = [(sensor_type.decode() if isinstance(sensor_type, bytes) else sensor_type) for sensor_type in redis.smembers(QUANTITY_TYPES_KEY)]
+    pipe = redis.pipeline()
+    for sensor_type in old_types:
+        pipe.smembers(quantity_key(sensor_type))
+    current = {sensor_type: {int(sensor_id) for sensor_id in members} for sensor_type, members in zip(old_types, pipe.execute())}
+
+    ids = {}
+    for sensor_type, sensor_id in db.query(models.Sensor.type, models.Sensor.id):
+        ids.setdefault(sensor_type, set()).add(sensor_id)
+
+    pipe = redis.pipeline()
+    for sensor_type, sensor_ids in ids.items():
+        pipe.sadd(QUANTITY_TYPES_KEY, sensor_type)
+        missing = sensor_ids - current.get(sensor_type, set())
+        if missing:
+            pipe.sadd(quantity_key(sensor_type), *missing)
+    for sensor_type, sensor_ids in current.items():
+        stale = sensor_ids - ids.get(sensor_type, set())
+        if stale:
+            pipe.srem(quantity_key(sensor_type), *stale)
+    pipe.execute()
+    quantities = {sensor_type: len(sensor_ids) for sensor_type, sensor_ids in ids.items()}
+    invalidate("sensors")
+    return quantities
+
+@traced
 def get_low_battery_sensors(db: Session, mongodb_client: MongoDBClient, cassandra_client: CassandraClient):
     query = """
         SELECT id, battery_level FROM sensor.battery WHERE battery_level < 0.2 ALLOW FILTERING;
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class Sensor(BaseModel):
     id: int
@@ -37,4 +37,15 @@ class SensorData(BaseModel):
     temperature: float | None = None
     humidity: float | None = None
     battery_level: float
-    last_seen: str
\ No newline at end of file
+    last_seen: str
+
+
+class SensorDataQuery(BaseModel):
+    sensor_ids: list[int] | None = None
+    type: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    radius: float | None = None
+    from_date: str = Field(alias='from')
+    end_date: str = Field(alias='to')
+    bucket: str = 'day'
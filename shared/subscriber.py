@@ -1,13 +1,20 @@
+import os
 import pika
 import time
 
+from opentelemetry import context
+
+from shared.metrics import instrument, timed
+from shared.tracing import extract_context
 from shared.publisher import QUEUE_NAME
 
+@instrument("rabbitmq", exclude=("subscribe", "consume", "start"))
 class Subscriber:
-    def __init__(self):
+    def __init__(self, queue_name=QUEUE_NAME):
+        self.queue_name = queue_name
         credentials = pika.PlainCredentials('guest', 'guest')
-        # Change the host to rabbitmq
-        parameters = pika.ConnectionParameters('localhost',
+        # Dins del docker-compose RABBITMQ_HOST és rabbitmq
+        parameters = pika.ConnectionParameters(os.environ.get("RABBITMQ_HOST", "localhost"),
                                        5672,
                                        '/',
                                        credentials)
@@ -19,9 +26,28 @@ class Subscriber:
         self.channel = self.conn.channel()
 
 
-    def subscribe(self, callback):
-        result = self.channel.queue_declare(queue=QUEUE_NAME)
-        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
+    def subscribe(self, callback, auto_ack=True):
+        self.consume(callback, auto_ack=auto_ack)
+        self.start()
+
+    def consume(self, callback, auto_ack=True, queue_name=None):
+        # Registra el callback per a una cua sense començar a consumir, així un sol procés pot escoltar-ne diverses
+        # Amb auto_ack=False el callback ha de fer ch.basic_ack, així un missatge no es perd si el callback falla
+        queue_name = queue_name or self.queue_name
+        self.channel.queue_declare(queue=queue_name)
+        # Mesurem cada missatge processat pel callback i continuem la traça que ve a les capçaleres
+        timed_callback = timed("rabbitmq", "consume", callback)
+
+        def traced_callback(ch, method, properties, body):
+            token = context.attach(extract_context(properties.headers))
+            try:
+                return timed_callback(ch, method, properties, body)
+            finally:
+                context.detach(token)
+
+        self.channel.basic_consume(queue=queue_name, on_message_callback=traced_callback, auto_ack=auto_ack)
+
+    def start(self):
         self.channel.start_consuming()
 
     def close(self):
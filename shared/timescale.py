@@ -1,34 +1,154 @@
+import io
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import os
+import threading
 
+from shared.metrics import instrument
 
+# Intervals de time_bucket permesos, mai posem el bucket que ens arriba directament a la query
+BUCKETS = {
+    'year': '1 year',
+    'month': '1 month',
+    'week': '1 week',
+    'day': '1 day',
+    'hour': '1 hour',
+}
+
+# Sentencies calentes que es preparen al servidor un sol cop per connexio
+STATEMENTS = {
+    'insert_sensor_data': """
+        INSERT INTO sensor_data (id, temperature, humidity, velocity, battery_level, last_seen)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (id, last_seen) DO UPDATE SET temperature = EXCLUDED.temperature, humidity = EXCLUDED.humidity, velocity = EXCLUDED.velocity, battery_level = EXCLUDED.battery_level
+    """,
+    'sensor_data_bucketed': """
+        SELECT id, time_bucket($1::interval, last_seen) AS time, AVG(velocity) AS velocity, AVG(temperature) AS temperature, AVG(humidity) AS humidity
+        FROM sensor_data
+        WHERE id = $2 AND last_seen >= $3 AND last_seen <= $4
+        GROUP BY id, time
+        ORDER BY time ASC
+    """,
+    'sensor_data_bucketed_many': """
+        SELECT id, time_bucket($1::interval, last_seen) AS time, AVG(velocity) AS velocity, AVG(temperature) AS temperature, AVG(humidity) AS humidity, AVG(battery_level) AS battery_level
+        FROM sensor_data
+        WHERE id = ANY($2::integer[]) AND last_seen >= $3 AND last_seen <= $4
+        GROUP BY id, time
+        ORDER BY id, time ASC
+    """,
+}
+
+
+def bucket_interval(bucket: str) -> str:
+    if bucket not in BUCKETS:
+        raise ValueError("Invalid bucket size")
+    return BUCKETS[bucket]
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    # Guardem quines sentencies ja estan preparades en aquesta connexio
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connection_params() -> dict:
+    return dict(
+        host=os.environ.get("TS_HOST"),
+        port=os.environ.get("TS_PORT"),
+        user=os.environ.get("TS_USER"),
+        password=os.environ.get("TS_PASSWORD"),
+        database=os.environ.get("TS_DBNAME"))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    # Les connexions es reutilitzen entre peticions perque les sentencies preparades no es perdin
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                1, int(os.environ.get("TS_POOL_SIZE", 10)),
+                connection_factory=PreparedConnection, **connection_params())
+        return _pool
+
+
+@instrument("timescale", exclude=("getCursor",))
 class Timescale:
     def __init__(self):
-        self.conn = psycopg2.connect(
-            host=os.environ.get("TS_HOST"),
-            port=os.environ.get("TS_PORT"),
-            user=os.environ.get("TS_USER"),
-            password=os.environ.get("TS_PASSWORD"),
-            database=os.environ.get("TS_DBNAME"))
+        try:
+            self.conn = get_pool().getconn()
+            self.pooled = True
+            if self.conn.closed:
+                get_pool().putconn(self.conn, close=True)
+                self.conn = get_pool().getconn()
+        except psycopg2.pool.PoolError:
+            # Si el pool esta ple obrim una connexio puntual
+            self.conn = psycopg2.connect(connection_factory=PreparedConnection, **connection_params())
+            self.pooled = False
         self.cursor = self.conn.cursor()
-        
+
     def getCursor(self):
             return self.cursor
 
     def close(self):
         self.cursor.close()
-        self.conn.close()
-    
+        if self.pooled:
+            get_pool().putconn(self.conn)
+        else:
+            self.conn.close()
+
     def ping(self):
         return self.conn.ping()
-    
-    def execute(self, query):
-       return self.cursor.execute(query)
-    
+
+    def execute(self, query, params=None):
+       return self.cursor.execute(query, params)
+
+    def commit(self):
+        self.conn.commit()
+
+    def execute_prepared(self, name, params):
+        if name not in self.conn.prepared:
+            self.cursor.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+            self.conn.prepared.add(name)
+        placeholders = ", ".join(["%s"] * len(params))
+        return self.cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
+    def insert_sensor_data(self, sensor_id: int, temperature: float | None, humidity: float | None, velocity: float | None, battery_level: float, last_seen: str):
+        self.execute_prepared('insert_sensor_data', (sensor_id, temperature, humidity, velocity, battery_level, last_seen))
+        self.commit()
+
+    def copy_sensor_data(self, rows) -> int:
+        # COPY a una taula temporal i d'alla un INSERT ... ON CONFLICT, aixi tornar a carregar un lot no falla per duplicats
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS sensor_data_staging (LIKE sensor_data) ON COMMIT DELETE ROWS")
+        self.cursor.copy_expert("COPY sensor_data_staging (id, temperature, humidity, velocity, battery_level, last_seen) FROM STDIN", buffer)
+        self.cursor.execute("""
+            INSERT INTO sensor_data (id, temperature, humidity, velocity, battery_level, last_seen)
+            SELECT DISTINCT ON (id, last_seen) id, temperature, humidity, velocity, battery_level, last_seen
+            FROM sensor_data_staging
+            ORDER BY id, last_seen
+            ON CONFLICT (id, last_seen) DO UPDATE SET temperature = EXCLUDED.temperature, humidity = EXCLUDED.humidity, velocity = EXCLUDED.velocity, battery_level = EXCLUDED.battery_level
+        """)
+        inserted = self.cursor.rowcount
+        self.commit()
+        return inserted
+
+    def get_bucketed_data(self, sensor_id: int, from_date: str, end_date: str, bucket: str) -> list:
+        self.execute_prepared('sensor_data_bucketed', (bucket_interval(bucket), sensor_id, from_date, end_date))
+        return self.cursor.fetchall()
+
+    def get_bucketed_data_many(self, sensor_ids: list[int], from_date: str, end_date: str, bucket: str) -> list:
+        self.execute_prepared('sensor_data_bucketed_many', (bucket_interval(bucket), list(sensor_ids), from_date, end_date))
+        return self.cursor.fetchall()
+
     def delete(self, table):
         self.cursor.execute("DELETE FROM " + table)
         self.conn.commit()
-
-        
-     
-         
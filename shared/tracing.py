@@ -0,0 +1,48 @@
+import functools
+import os
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+tracer = trace.get_tracer("senser")
+
+
+def setup_tracing(service_name):
+    # TRACING_EXPORTER pot ser "none" (per defecte), "file" (un span JSON per línia a TRACING_FILE) o "otlp"
+    exporter_name = os.environ.get("TRACING_EXPORTER", "none")
+    if exporter_name == "none":
+        return
+
+    if exporter_name == "otlp":
+        # Requereix opentelemetry-exporter-otlp, es configura amb les variables OTEL_EXPORTER_OTLP_*
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        out = open(os.environ.get("TRACING_FILE", "traces.jsonl"), "a")
+        exporter = ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def traced(func):
+    """Obre un span amb el nom de la funció mentre s'executa."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracer.start_as_current_span(func.__qualname__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def inject_headers() -> dict:
+    # Capçaleres W3C (traceparent) del span actual per enviar-les amb el missatge
+    headers = {}
+    propagate.inject(headers)
+    return headers
+
+
+def extract_context(headers):
+    return propagate.extract(headers or {})
@@ -0,0 +1,88 @@
+import contextvars
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import Session
+
+from shared.metrics import DROPPED_WRITES
+from shared.sensors import models
+
+logger = logging.getLogger(__name__)
+
+# Pool compartit i acotat per a les escriptures secundàries de totes les peticions del procés
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("WRITE_POOL_SIZE", 16)), thread_name_prefix="writes")
+
+# Operacions d'escriptura que es poden reintentar: nom -> (backend, funció(client, payload))
+OPERATIONS = {}
+
+
+def write_operation(name, backend):
+    """Registra una escriptura idempotent perquè es pugui reintentar a partir del nom i el payload."""
+    def decorator(func):
+        OPERATIONS[name] = (backend, func)
+        return func
+    return decorator
+
+
+def submit(func, *args):
+    # Copiem el context perquè els spans de cada escriptura pengin de la petició
+    return _executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def fan_out(db: Session, writes, required=(), best_effort=()):
+    """
+    Executa en paral·lel les escriptures [(nom, client, payload), ...] i espera que acabin totes.
+
+    Les que fallen i no són a required es guarden a failed_writes per reintentar-les més tard, menys les de
+    best_effort, que només es compten a dropped_writes_total i es descarten.
+    Si en falla alguna de required, es llença la seva excepció.
+    """
+    futures = [(name, payload, submit(OPERATIONS[name][1], client, payload)) for name, client, payload in writes]
+
+    failures = {}
+    for name, payload, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            failures[name] = e
+            if name in best_effort:
+                DROPPED_WRITES.labels(name).inc()
+                logger.warning("Dropping best-effort write %s: %r", name, e)
+            elif name not in required:
+                db.add(models.FailedWrite(operation=name, payload=json.dumps(payload), error=repr(e)))
+    if any(name not in required and name not in best_effort for name in failures):
+        db.commit()
+
+    for name in required:
+        if name in failures:
+            raise failures[name]
+    return failures
+
+
+def retry_failed_writes(db: Session, clients: dict, limit: int = 100):
+    """Torna a executar les escriptures pendents amb els clients donats per backend ({'mongodb': ..., ...})."""
+    pending = db.query(models.FailedWrite).order_by(models.FailedWrite.id).limit(limit).all()
+    futures = []
+    for failed in pending:
+        if failed.operation not in OPERATIONS:
+            # Escriptures d'operacions que ja no existeixen (p.ex. d'una versió anterior), no es poden reintentar
+            logger.warning("Dropping failed write %s of removed operation %s", failed.id, failed.operation)
+            db.delete(failed)
+            continue
+        backend, func = OPERATIONS[failed.operation]
+        futures.append((failed, submit(func, clients[backend], json.loads(failed.payload))))
+
+    retried = 0
+    for failed, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            failed.attempts += 1
+            failed.error = repr(e)
+        else:
+            db.delete(failed)
+            retried += 1
+    db.commit()
+    return {'retried': retried, 'pending': len(pending) - retried}